@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Benchmark single-prompt vs fan-out job posting generation against the Gemini API
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import bot
+
+
+def run_once(mode, role, company, location):
+    """Generate one posting with a cold company description cache and return (seconds, posting)"""
+    bot.company_description_cache.clear()
+    start = time.perf_counter()
+    posting = asyncio.run(bot.generate_job_posting(role, company, location, mode=mode))
+    return time.perf_counter() - start, posting
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--role', default='Backend Engineer')
+    parser.add_argument('--company', default='Google')
+    parser.add_argument('--location', default='Bangalore, India')
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    for mode in ['single', 'fanout']:
+        timings = []
+        for _ in range(args.runs):
+            elapsed, posting = run_once(mode, args.role, args.company, args.location)
+            missing = bot.find_missing_sections(posting) if posting else bot.POSTING_SECTIONS
+            timings.append(elapsed)
+            print(f"{mode:>7}: {elapsed:.2f}s, {len(posting or '')} chars, missing sections: {missing}")
+        print(f"{mode:>7}: mean {statistics.mean(timings):.2f}s, median {statistics.median(timings):.2f}s, "
+              f"min {min(timings):.2f}s over {args.runs} runs\n")
+
+
+if __name__ == "__main__":
+    main()
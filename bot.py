@@ -5,22 +5,37 @@ JD Bot - A versatile bot for various tasks
 
 import os
 import google.generativeai as genai
+from google.generativeai.client import get_default_generative_client
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, stream_with_context
 import re
 import json
+import socket
+import copy
+import atexit
+import gzip
+import hashlib
 import threading
 import queue
+import time
 import asyncio
+import contextvars
 import concurrent.futures
+from collections import OrderedDict
+from datetime import date
 from functools import partial
 
+try:
+    import brotli
+except ImportError:  # Optional, gzip is used when brotli is not installed
+    brotli = None
+
 # Load environment variables
 load_dotenv()
 
 # Configure Gemini
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-genai.configure(api_key=GOOGLE_API_KEY)
+genai.configure(api_key=GOOGLE_API_KEY, transport=os.getenv('GEMINI_TRANSPORT', 'grpc'))
 
 # Initialize Flask
 app = Flask(__name__)
@@ -50,8 +65,263 @@ model = genai.GenerativeModel(
     safety_settings=safety_settings
 )
 
+# Create the API client up front so every thread shares one connection instead of
+# racing to open its own on first use
+get_default_generative_client()
+
+# Worker threads for blocking Gemini calls, sized for the upstream quota rather than the CPU
+LLM_MAX_WORKERS = int(os.getenv('LLM_MAX_WORKERS', '8'))
+# Concurrent calls allowed per stage, overridable with e.g. LLM_STAGE_LIMITS="generate=4,summary=1"
+LLM_STAGE_LIMITS = {
+    'one_shot': 4,
+    'extract': 4,
+    'company': 4,
+    'generate': 6,
+    'repair': 4,
+    'chat': 2,
+    'intent': 2,
+    'modify': 2,
+    'summary': 1,
+    'prefetch': 2,
+    'warmup': 1,
+}
+for item in filter(None, os.getenv('LLM_STAGE_LIMITS', '').split(',')):
+    stage, _, limit = item.partition('=')
+    LLM_STAGE_LIMITS[stage.strip()] = int(limit)
+
+llm_executor = concurrent.futures.ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS, thread_name_prefix='llm-io')
+llm_stage_limiters = {}
+llm_metrics = {}
+llm_metrics_lock = threading.Lock()
+
+# Minimum seconds between the starts of calls in paced stages, and when each may start next
+LLM_STAGE_INTERVALS = {}
+llm_stage_next_start = {}
+
+# Background jobs set this to run every LLM call they make, at any depth, in their own stage
+llm_stage_override = contextvars.ContextVar('llm_stage_override', default=None)
+# Background jobs set this to a list to learn which fallbacks were used on their behalf
+llm_fallbacks = contextvars.ContextVar('llm_fallbacks', default=None)
+
+def note_fallback(what):
+    """Record that template or placeholder content stood in for an LLM result"""
+    fallbacks = llm_fallbacks.get()
+    if fallbacks is not None:
+        fallbacks.append(what)
+
+def stage_limiter(stage):
+    with llm_metrics_lock:
+        if stage not in llm_stage_limiters:
+            llm_stage_limiters[stage] = threading.BoundedSemaphore(LLM_STAGE_LIMITS.get(stage, LLM_MAX_WORKERS))
+        return llm_stage_limiters[stage]
+
+def pace_stage(stage):
+    """Reserve the next start slot of a paced stage and return the seconds to wait for it"""
+    interval = LLM_STAGE_INTERVALS.get(stage)
+    if not interval:
+        return 0.0
+    with llm_metrics_lock:
+        now = time.monotonic()
+        start = max(now, llm_stage_next_start.get(stage, now))
+        llm_stage_next_start[stage] = start + interval
+    return start - now
+
+def record_llm_call(stage, queue_wait, run_time, failed):
+    with llm_metrics_lock:
+        stats = llm_metrics.setdefault(stage, {
+            'calls': 0, 'failures': 0, 'queue_wait_total': 0.0, 'queue_wait_max': 0.0, 'run_time_total': 0.0
+        })
+        stats['calls'] += 1
+        stats['failures'] += int(failed)
+        stats['queue_wait_total'] += queue_wait
+        stats['queue_wait_max'] = max(stats['queue_wait_max'], queue_wait)
+        stats['run_time_total'] += run_time
+
+def _run_llm_call(stage, queued_at, func, args, kwargs):
+    started_at = time.monotonic()
+    failed = True
+    try:
+        result = func(*args, **kwargs)
+        failed = False
+        return result
+    finally:
+        record_llm_call(stage, started_at - queued_at, time.monotonic() - started_at, failed)
+
+def _submit_llm_call(stage, limiter, queued_at, func, args, kwargs):
+    # The stage slot is released when the call finishes, or if it is cancelled before starting
+    future = llm_executor.submit(_run_llm_call, stage, queued_at, func, args, kwargs)
+    future.add_done_callback(lambda _: limiter.release())
+    return future
+
+def call_llm(stage, func, *args, deadline=None, **kwargs):
+    """Run a blocking Gemini call on the LLM executor, within the stage's concurrency cap.
+
+    With a deadline, waiting for a slot and for the result is limited to the
+    stage's share of it; TimeoutError is raised when that runs out.
+    """
+    stage = llm_stage_override.get() or stage
+    queued_at = time.monotonic()
+    time.sleep(pace_stage(stage))
+    limiter = stage_limiter(stage)
+    timeout = deadline.stage_timeout(stage) if deadline is not None else None
+    if not limiter.acquire(timeout=timeout):
+        raise TimeoutError(f"No free {stage} slot within the deadline")
+    future = _submit_llm_call(stage, limiter, queued_at, func, args, kwargs)
+    try:
+        return future.result(timeout=None if timeout is None else max(0.0, queued_at + timeout - time.monotonic()))
+    except concurrent.futures.TimeoutError:
+        future.cancel()  # Frees the slot if the call has not started yet
+        raise
+
+async def call_llm_async(stage, func, *args, **kwargs):
+    """Async version of call_llm that waits for a stage slot without blocking the event loop"""
+    stage = llm_stage_override.get() or stage
+    queued_at = time.monotonic()
+    await asyncio.sleep(pace_stage(stage))
+    limiter = stage_limiter(stage)
+    while not limiter.acquire(blocking=False):
+        await asyncio.sleep(0.01)
+    return await asyncio.wrap_future(_submit_llm_call(stage, limiter, queued_at, func, args, kwargs))
+
+# Chat history limits (token counts are estimated at ~4 characters per token)
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv('CHAT_HISTORY_TOKEN_BUDGET', '2000'))
+CHAT_HISTORY_MAX_TURNS = int(os.getenv('CHAT_HISTORY_MAX_TURNS', '6'))
+CHAT_SUMMARY_EVERY = int(os.getenv('CHAT_SUMMARY_EVERY', '4'))
+
+def estimate_tokens(text):
+    """Rough token estimate used for history budgeting"""
+    return len(text) // 4 + 1 if text else 0
+
+class ChatHistoryManager:
+    """Bounded chat history for the Gemini chat session.
+
+    Recent turns are kept verbatim in a rolling window limited by turn count
+    and token budget. Turns that fall out of the window are periodically folded
+    into a compact digest by a background summarizer, so the prompt sent with
+    each message stays roughly the same size however long the conversation runs.
+    """
+
+    def __init__(self, model, token_budget=CHAT_HISTORY_TOKEN_BUDGET,
+                 max_turns=CHAT_HISTORY_MAX_TURNS, summary_every=CHAT_SUMMARY_EVERY):
+        self.model = model
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.summary_every = summary_every
+        self.digest = ""
+        self.turns = []      # (user_text, model_text) pairs inside the window
+        self.evicted = []    # turns dropped from the window, awaiting summary
+        self._summarizing = False
+        self._generation = 0  # bumped on reset so stale summaries are discarded
+        self._lock = threading.Lock()
+
+    def history(self):
+        """Build the history passed to start_chat: digest first, then the window"""
+        with self._lock:
+            history = []
+            if self.digest:
+                history.append({'role': 'user', 'parts': [f"Summary of our earlier conversation: {self.digest}"]})
+                history.append({'role': 'model', 'parts': ["Got it, I'll keep that in mind."]})
+            for user_text, model_text in self.turns:
+                history.append({'role': 'user', 'parts': [user_text]})
+                history.append({'role': 'model', 'parts': [model_text]})
+            return history
+
+    def history_tokens(self):
+        """Estimated token size of the history sent with the next message"""
+        with self._lock:
+            return self._tokens()
+
+    def send_message(self, message, stage='chat', remember=True, deadline=None):
+        """Send a message on a fresh session seeded with the bounded history.
+
+        With remember=False the exchange is not added to the history, for
+        prompts whose size would crowd out the conversation itself.
+        """
+        session = self.model.start_chat(history=self.history())
+        response = call_llm(stage, session.send_message, message, deadline=deadline)
+        text = response.text
+
+        if remember:
+            self.add_turn(message, text)
+        return text
+
+    def add_turn(self, user_text, model_text):
+        """Record a turn that was answered without going through the chat session"""
+        with self._lock:
+            self.turns.append((user_text, model_text))
+            self._trim()
+
+    def reset(self):
+        """Drop all history, including any summary in progress"""
+        with self._lock:
+            self.digest = ""
+            self.turns = []
+            self.evicted = []
+            self._generation += 1
+
+    def _tokens(self):
+        return estimate_tokens(self.digest) + sum(
+            estimate_tokens(user_text) + estimate_tokens(model_text)
+            for user_text, model_text in self.turns
+        )
+
+    def _trim(self):
+        # Always keep the latest turn, even if it alone exceeds the budget
+        while len(self.turns) > 1 and (len(self.turns) > self.max_turns or self._tokens() > self.token_budget):
+            self.evicted.append(self.turns.pop(0))
+
+        if len(self.evicted) >= self.summary_every and not self._summarizing:
+            batch, self.evicted = self.evicted, []
+            self._summarizing = True
+            threading.Thread(
+                target=self._summarize, args=(batch, self.digest, self._generation), daemon=True
+            ).start()
+
+    def _summarize(self, batch, digest, generation):
+        transcript = "\n".join(f"User: {user_text}\nBot: {model_text}" for user_text, model_text in batch)
+        max_words = max(50, self.token_budget // 8)
+        prompt = f"""Update the running summary of a conversation between a user and a job posting assistant.
+
+Current summary:
+{digest or 'None'}
+
+New conversation turns:
+{transcript}
+
+Keep every job detail mentioned (role, company, location, experience, skills, requested changes).
+Return only the updated summary in at most {max_words} words."""
+
+        try:
+            response = call_llm('summary', self.model.generate_content, prompt)
+            new_digest = response.text.strip()
+        except Exception as e:
+            print(f"Error summarizing chat history: {str(e)}")
+            new_digest = None
+
+        with self._lock:
+            if generation == self._generation and new_digest:
+                # Hard cap in case the model ignores the word limit
+                self.digest = new_digest[:self.token_budget * 2]
+            self._summarizing = False
+
 # Initialize chat
-chat = model.start_chat(history=[])
+chat_history = ChatHistoryManager(model)
+
+# Responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+
+# Compressed bodies of cacheable responses, keyed by (etag, encoding)
+compressed_cache = {}
+compressed_cache_lock = threading.Lock()
+COMPRESSED_CACHE_SIZE = 64
+
+# Rendered page templates, keyed by template name: (mtime, html, etag)
+page_cache = {}
+
+# Rendered postings, keyed by (content hash, export format), least recently used first
+render_cache = OrderedDict()
+render_cache_lock = threading.Lock()
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '128'))
 
 # Global variables to store conversation state and job details
 conversation_state = {
@@ -91,6 +361,258 @@ job_details = {
 
 final_job_posting = None
 conversation_history = []
+# Revisions of the current posting as section-level deltas, oldest first
+posting_revisions = []
+
+# Append-only log of conversation turns and posting revisions
+EVENT_LOG_PATH = os.getenv('EVENT_LOG_PATH', os.path.join('data', 'events.jsonl'))
+EVENT_LOG_BATCH_SIZE = int(os.getenv('EVENT_LOG_BATCH_SIZE', '64'))
+EVENT_LOG_FLUSH_MS = int(os.getenv('EVENT_LOG_FLUSH_MS', '200'))
+# Turns kept in memory for prompt context; the log keeps all of them
+CONVERSATION_HISTORY_LIMIT = 50
+UNDO_COMMANDS = {'undo', 'undo that', 'revert', 'revert that', 'go back'}
+
+# Sections every job posting must contain, in canonical order
+POSTING_SECTIONS = ['About', 'Role Overview', 'Key Responsibilities', 'Required Qualifications', 'Preferred Qualifications', 'Benefits']
+
+# Sections written as bullet lists; the rest are paragraphs
+LIST_SECTIONS = ['Key Responsibilities', 'Required Qualifications', 'Preferred Qualifications', 'Benefits']
+
+# What each section should contain when it is generated on its own
+SECTION_GUIDELINES = {
+    'About': "2-3 sentences on the company's main business, industry and notable achievements.",
+    'Role Overview': "3-4 sentences describing what the role involves, its impact and team structure. Include location and experience requirements.",
+    'Key Responsibilities': "5-6 bullet points with the main responsibilities specific to this role.",
+    'Required Qualifications': "5-6 bullet points with the required experience, skills and qualifications, including every listed requirement.",
+    'Preferred Qualifications': "3-4 bullet points with nice-to-have qualifications.",
+    'Benefits': "4-5 bullet points with benefits and perks.",
+}
+
+# Try extraction and generation in a single call before falling back to the multi-step path
+ONE_SHOT_GENERATION = os.getenv('ONE_SHOT_GENERATION', 'true').lower() == 'true'
+
+# 'single' writes the posting with one prompt, 'fanout' generates each section concurrently
+POSTING_GENERATION_MODE = os.getenv('POSTING_GENERATION_MODE', 'single').lower()
+
+# Overall time budget for a /chat request, shared by all of its LLM stages
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '20'))
+# Stages are skipped in favour of cheaper fallbacks below this many seconds
+MIN_STAGE_SECONDS = float(os.getenv('MIN_STAGE_SECONDS', '2'))
+# Share of the remaining budget each stage may use
+STAGE_BUDGET_SHARE = {
+    'one_shot': 0.5,  # Leaves the extraction fallback enough time if it times out
+    'extract': 0.3,
+    'company': 0.35,
+    'generate': 0.9,
+    'repair': 0.9,
+    'intent': 0.3,
+    'modify': 0.9,
+}
+
+# Company descriptions already fetched, keyed by lowercased company name
+company_description_cache = {}
+
+# Postings generated ahead of time by the warm-up, keyed by posting_cache_key: (posting, expires at)
+posting_cache = {}
+POSTING_CACHE_TTL_SECONDS = float(os.getenv('POSTING_CACHE_TTL_SECONDS', '21600'))
+
+# Companies and role templates to pre-generate after startup (see warmup.example.json)
+WARMUP_FILE = os.getenv('WARMUP_FILE', 'warmup.json')
+# LLM calls per minute the warm-up may use, so it stays well inside the rate limit
+WARMUP_CALLS_PER_MINUTE = float(os.getenv('WARMUP_CALLS_PER_MINUTE', '10'))
+warmup_status = {'state': 'idle', 'total': 0, 'done': 0, 'failed': 0, 'current': None}
+if WARMUP_CALLS_PER_MINUTE > 0:
+    LLM_STAGE_INTERVALS['warmup'] = 60.0 / WARMUP_CALLS_PER_MINUTE
+
+# Prepare likely work in the background while waiting for the user to answer a follow-up question
+SPECULATIVE_PREFETCH = os.getenv('SPECULATIVE_PREFETCH', 'true').lower() == 'true'
+# Prefetched drafts older than this are dropped instead of used
+PREFETCH_TTL_SECONDS = float(os.getenv('PREFETCH_TTL_SECONDS', '120'))
+# Role-specific sections that do not depend on the still-missing details
+PREFETCH_SECTIONS = ['Key Responsibilities', 'Required Qualifications', 'Preferred Qualifications']
+
+prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+# The pending prefetch: the inputs the drafts were written for, start time and section futures
+prefetch_state = {}
+prefetch_lock = threading.Lock()
+
+class Deadline:
+    """Time budget for a single request, propagated through every LLM stage"""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def stage_timeout(self, stage):
+        """Seconds the given stage may spend, as a share of what is left"""
+        return self.remaining() * STAGE_BUDGET_SHARE.get(stage, 1.0)
+
+    def can_afford(self, stage):
+        return self.stage_timeout(stage) >= MIN_STAGE_SECONDS
+
+async def with_deadline(awaitable, deadline, stage):
+    """Await within the stage's share of the deadline; no limit without a deadline"""
+    if deadline is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, timeout=deadline.stage_timeout(stage))
+
+class TolerantJSONParser:
+    """Incremental scanner that recovers a JSON object from LLM output.
+
+    Text can be fed in chunks as it arrives. Code fences and any text before
+    or after the object are ignored, trailing commas are dropped, raw newlines
+    inside strings are accepted, and an object cut off part-way (e.g. by the
+    output token limit) is closed at the last point where it was still valid.
+    If the text from the first '{' cannot be recovered, as in 'Here is {role}:
+    {...}', scanning starts again from the next '{'.
+    """
+
+    CLOSERS = {'{': '}', '[': ']'}
+
+    def __init__(self):
+        self.buffer = []
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        self.done = False
+        self.checkpoints = []  # (length, open brackets) where the object can be cut and closed
+        self.after = []  # Text fed after the object closed, kept for rescanning
+
+    def feed(self, chunk):
+        for position, char in enumerate(chunk):
+            if self.done:
+                self.after.append(chunk[position:])
+                break
+            if not self.buffer and char != '{':
+                continue
+            self.buffer.append(char)
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.stack.append(char)
+                self.checkpoints.append((len(self.buffer), list(self.stack)))
+            elif char in '}]':
+                if self.stack:
+                    self.stack.pop()
+                if self.stack:
+                    self.checkpoints.append((len(self.buffer), list(self.stack)))
+                else:
+                    self.done = True
+            elif char == ',':
+                self.checkpoints.append((len(self.buffer) - 1, list(self.stack)))
+        return self
+
+    def result(self):
+        """Return (value, repaired), or (None, False) if nothing could be recovered"""
+        parser = self
+        while parser.buffer:
+            value, repaired = parser._recover()
+            if value is not None:
+                return value, repaired
+            parser = TolerantJSONParser().feed(''.join(parser.buffer[1:] + parser.after))
+        return None, False
+
+    def _recover(self):
+        text = ''.join(self.buffer)
+        if self.done:
+            try:
+                return json.loads(text, strict=False), False
+            except ValueError:
+                candidates = [text]
+        else:
+            # Truncated: first try to keep the partial value, then back off to earlier checkpoints
+            tail = text[:-1] if self.escaped else text
+            candidates = [tail + ('"' if self.in_string else '') + self._closers(self.stack)]
+            candidates += [text[:length] + self._closers(stack) for length, stack in reversed(self.checkpoints)]
+
+        for candidate in candidates:
+            try:
+                return json.loads(re.sub(r',\s*([}\]])', r'\1', candidate), strict=False), True
+            except ValueError:
+                continue
+        return None, False
+
+    def _closers(self, stack):
+        return ''.join(self.CLOSERS[bracket] for bracket in reversed(stack))
+
+# Outcomes of parsing JSON from LLM responses
+json_parse_stats = {'clean': 0, 'repaired': 0, 'failed': 0}
+
+def apply_schema(data, schema):
+    """Fill in a parsed object from a schema of {key: (types, default)} or nested schemas"""
+    data = data if isinstance(data, dict) else {}
+    result = {}
+    for key, spec in schema.items():
+        if isinstance(spec, dict):
+            result[key] = apply_schema(data.get(key), spec)
+        else:
+            types, default = spec
+            value = data.get(key)
+            result[key] = value if isinstance(value, types) else copy.deepcopy(default)
+    return result
+
+def parse_llm_json(text, schema=None, name='response'):
+    """Parse a JSON object from an LLM response, repairing it where possible.
+
+    Returns None if no object could be recovered; otherwise the object, with
+    missing or mistyped fields replaced by the schema defaults.
+    """
+    value, repaired = TolerantJSONParser().feed(text or '').result()
+    outcome = 'failed' if value is None else 'repaired' if repaired else 'clean'
+    with llm_metrics_lock:
+        json_parse_stats[outcome] += 1
+
+    if value is None:
+        print(f"Could not parse JSON {name}: {(text or '')[:200]!r}")
+        return None
+    if repaired:
+        print(f"Repaired malformed JSON {name}")
+    return apply_schema(value, schema) if schema else value
+
+def extracted_field(types, default=None):
+    """Schema for a {"value": ..., "confidence": ...} extraction field"""
+    return {'value': (types, default), 'confidence': ((int, float), 0.0)}
+
+# Response schemas for the structured LLM calls
+EXTRACTION_SCHEMA = {
+    'role': extracted_field(str),
+    'company': extracted_field(str),
+    'experience': extracted_field((str, int, float)),
+    'location': extracted_field(str),
+    'requirements': extracted_field(list, []),
+}
+INTENT_SCHEMA = {
+    'intent': (str, 'modify'),
+    'confidence': ((int, float), 0.0),
+}
+VERIFICATION_SCHEMA = {
+    'success': (bool, False),
+    'error': (str, None),
+}
+# Same keys as job_details, apart from the role and company
+ADDITIONAL_DETAILS_SCHEMA = {
+    'total_experience': ((str, int, float), None),
+    'relevant_experience': ((str, int, float), None),
+    'skills': (list, []),
+    'tech_stack': (list, []),
+    'requirements': (list, []),
+    'education': (str, None),
+    'location': {
+        'city': (str, None),
+        'state': (str, None),
+        'country': (str, None),
+    },
+}
 
 def run_async(func):
     """Decorator to run async functions in sync context"""
@@ -102,7 +624,7 @@ def run_async(func):
         return result
     return wrapper
 
-async def extract_job_info_async(message):
+async def extract_job_info_async(message, deadline=None):
     """Async version of extract_job_info with improved extraction"""
     print(f"Starting job info extraction for message: {message}")
     
@@ -149,39 +671,58 @@ async def extract_job_info_async(message):
         }}
         """
         
-        response = await asyncio.to_thread(model.generate_content, extraction_prompt)
-        response_text = response.text
-        
-        try:
-            json_str = response_text.strip()
-            if json_str.startswith('```json'):
-                json_str = json_str[7:]
-            if json_str.endswith('```'):
-                json_str = json_str[:-3]
-            json_str = json_str.strip()
-            
-            extracted_info = json.loads(json_str)
-            print("Extracted info:", extracted_info)
-            return extracted_info
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {str(e)}")
-            return {
-                "role": {"value": None, "confidence": 0.0},
-                "company": {"value": None, "confidence": 0.0},
-                "experience": {"value": None, "confidence": 0.0},
-                "location": {"value": None, "confidence": 0.0},
-                "requirements": {"value": [], "confidence": 0.0}
-            }
-            
+        response = await with_deadline(call_llm_async('extract', model.generate_content, extraction_prompt), deadline, 'extract')
+        extracted_info = parse_llm_json(response.text, EXTRACTION_SCHEMA, 'extraction')
+        if extracted_info is None:
+            return extract_job_info_locally(message)
+
+        print("Extracted info:", extracted_info)
+        return extracted_info
+
     except Exception as e:
-        print(f"Error in extract_job_info: {str(e)}")
-        return {
-            "role": {"value": None, "confidence": 0.0},
-            "company": {"value": None, "confidence": 0.0},
-            "experience": {"value": None, "confidence": 0.0},
-            "location": {"value": None, "confidence": 0.0},
-            "requirements": {"value": [], "confidence": 0.0}
-        }
+        # Timeouts land here too; the caller treats all-null fields as missing info
+        print(f"Error in extract_job_info: {str(e) or type(e).__name__}")
+        return extract_job_info_locally(message)
+
+# Phrasings understood without the LLM: "Field: value" lines and "<role> at <company> in <location>"
+LABELLED_FIELD = re.compile(r'^\s*(role|position|title|company|location|experience)\s*:\s*(.+?)\s*$', re.I | re.M)
+ROLE_AT_COMPANY = (
+    r"(?P<role>[A-Za-z][\w+#/-]*(?:\s+[A-Za-z][\w+#/-]*){0,5}?)\s+(?:at|At|@)\s+"
+    r"(?P<company>[A-Za-z0-9][\w.&'-]*(?:\s+[A-Z0-9][\w.&'-]*)*)"
+    r"(?:\s*(?:,|\bin\b|\bbased in\b)\s*(?P<location>[Rr]emote|[A-Z][\w-]*(?:,?\s+[A-Z][\w-]*)*))?"
+)
+ROLE_AT_COMPANY_PATTERNS = [
+    re.compile(r"\b(?:for|hiring)\s+(?:an?\s+)?" + ROLE_AT_COMPANY),
+    re.compile(r"^\s*(?:an?\s+)?" + ROLE_AT_COMPANY),
+]
+EXPERIENCE_PATTERN = re.compile(r'\b\d+\+?\s*(?:-\s*\d+\s*)?years?\b', re.I)
+
+def extract_job_info_locally(message):
+    """Best-effort extraction without the LLM, for when the extraction call fails or times out.
+
+    Fields found get confidence 0.6, so a slow model does not make the user
+    repeat details they already gave.
+    """
+    found = {}
+    for field, value in LABELLED_FIELD.findall(message):
+        field = field.lower()
+        found['role' if field in ('position', 'title') else field] = value
+    for pattern in ROLE_AT_COMPANY_PATTERNS:
+        match = pattern.search(message)
+        if match:
+            for field, value in match.groupdict().items():
+                if value:
+                    found.setdefault(field, value.strip())
+            break
+    experience = EXPERIENCE_PATTERN.search(message)
+    if experience:
+        found.setdefault('experience', experience.group(0))
+
+    job_info = apply_schema({}, EXTRACTION_SCHEMA)
+    for field, value in found.items():
+        job_info[field] = {'value': value, 'confidence': 0.6}
+    print("Extracted info without the LLM:", job_info)
+    return job_info
 
 def extract_location(text):
     """Extract city, state, and country from location text"""
@@ -190,7 +731,7 @@ def extract_location(text):
     Text: {text}
     Return in format: city|||state|||country
     """
-    response = model.generate_content(prompt)
+    response = call_llm('extract', model.generate_content, prompt)
     parts = response.text.split('|||')
     if len(parts) == 3:
         return {
@@ -228,27 +769,29 @@ def extract_additional_details(text):
         - Look for location flexibility mentions
 
     Text: {text}
-    Return in JSON format with clear categorization
+    Return JSON, using null for missing values and [] for missing lists:
+    {{
+        "total_experience": "extracted total experience",
+        "relevant_experience": "extracted relevant experience",
+        "skills": ["skill1", "skill2"],
+        "tech_stack": ["tool1", "tool2"],
+        "requirements": ["requirement1", "requirement2"],
+        "education": "extracted education",
+        "location": {{"city": "city", "state": "state", "country": "country"}}
+    }}
     """
-    response = model.generate_content(prompt)
-    try:
-        import json
-        details = json.loads(response.text)
-        return details
-    except:
-        return None
+    response = call_llm('extract', model.generate_content, prompt)
+    return parse_llm_json(response.text, ADDITIONAL_DETAILS_SCHEMA, 'job details')
 
 def generate_response(user_input):
     """Generate response using chat history and context."""
-    global chat
-    
     try:
         # Extract job information from user input
         job_info = extract_job_info(user_input)
         
         if job_info:
             # Add user's message to chat history
-            chat.send_message(user_input, stream=True)
+            chat_history.send_message(user_input)
             
             # Get a natural acknowledgment using Gemini
             acknowledgment_prompt = f"""
@@ -261,8 +804,7 @@ def generate_response(user_input):
             Previous message: {user_input}
             """
             try:
-                ack_response = model.generate_content(acknowledgment_prompt, stream=True)
-                acknowledgment = "".join(chunk.text for chunk in ack_response)
+                acknowledgment = call_llm('chat', model.generate_content, acknowledgment_prompt).text
             except:
                 acknowledgment = "I understand"
             
@@ -301,9 +843,7 @@ def generate_response(user_input):
                 """
                 
                 try:
-                    # Use chat.send_message with streaming
-                    chat_response = chat.send_message(response_prompt, stream=True)
-                    prompt = "".join(chunk.text for chunk in chat_response)
+                    prompt = chat_history.send_message(response_prompt)
                 except:
                     # Fallback to basic response
                     prompt = f"{acknowledgment}, {', '.join(context)}. "
@@ -328,8 +868,8 @@ def generate_response(user_input):
             else:
                 prompt = f"{acknowledgment}, I couldn't quite understand the job details. Could you please specify the role and company more clearly?"
                 
-            # Add the prompt to chat history with streaming
-            chat.send_message(prompt, stream=True)
+            # Add the prompt to chat history
+            chat_history.send_message(prompt)
             return prompt
         else:
             return "I'm having trouble understanding the job details. Could you please rephrase your request?"
@@ -337,15 +877,26 @@ def generate_response(user_input):
     except Exception as e:
         print(f"Error in generate_response: {str(e)}")
         # Reset chat history if there's an error
-        chat = model.start_chat(history=[])
+        chat_history.reset()
         return "I encountered an error. Let's start fresh - could you tell me about the job role and company?"
 
-async def generate_job_posting(role, company, location=None, experience=None, requirements=None, conversation_history=None):
-    """Generate a job posting using AI with enhanced context."""
-    print(f"Generating job posting for {role} at {company}")
-    
-    # Format location string if it exists
-    location_str = ""
+def build_conversation_context(conversation_history):
+    """Summarize the last few conversation turns for generation prompts"""
+    if not conversation_history:
+        return ""
+    return "Previous conversation context:\n" + "\n".join([
+        f"User: {msg['user']}\nBot: {msg['bot']}" 
+        for msg in conversation_history[-3:]  # Use last 3 messages for context
+    ])
+
+def posting_cache_key(role, company, location_str, experience, requirements):
+    """Normalized key for the posting cache"""
+    def norm(value):
+        return str(value or '').strip().lower()
+    return (norm(role), norm(company), norm(location_str), norm(experience), tuple(sorted(norm(r) for r in requirements or [])))
+
+def format_location(location):
+    """Format a location dict or string for display"""
     if isinstance(location, dict):
         parts = []
         if location.get('city'):
@@ -354,20 +905,92 @@ async def generate_job_posting(role, company, location=None, experience=None, re
             parts.append(location['state'])
         if location.get('country'):
             parts.append(location['country'])
-        location_str = ", ".join(filter(None, parts))
-    elif location:
-        location_str = location
+        return ", ".join(filter(None, parts))
+    return location or ""
+
+def unwrap_extracted(field):
+    """Accept extraction results ({"value": ..., "confidence": ...}) as well as plain values"""
+    if isinstance(field, dict):
+        return field.get('value')
+    return field
+
+def stream_llm_text(func, prompt, on_text):
+    """Make a streaming Gemini call, passing the text received so far to on_text after each chunk"""
+    text = ''
+    for chunk in func(prompt, stream=True):
+        text += chunk.text
+        on_text(text)
+    return text
+
+async def generate_text_async(stage, prompt, deadline=None, on_text=None):
+    """Run a generate_content call within the stage's deadline and return its text.
+
+    With on_text, the response is streamed and on_text gets the text so far
+    after every chunk.
+    """
+    if on_text is None:
+        response = await with_deadline(call_llm_async(stage, model.generate_content, prompt), deadline, stage)
+        return response.text
+    return await with_deadline(call_llm_async(stage, stream_llm_text, model.generate_content, prompt, on_text), deadline, stage)
+
+class StreamedPosting:
+    """Reports the parts of a markdown posting while it is still being written.
+
+    update() takes the posting text received so far. The title and each '## '
+    section are passed to on_section(index, markdown) once the next heading
+    shows they are complete, and finish() reports the last one. Indexes follow
+    render_posting(posting, 'sections'), so the final render can replace them.
+    """
+
+    def __init__(self, on_section):
+        self.on_section = on_section
+        self.reported = 0
+
+    def update(self, text, final=False):
+        parts = [part for part in re.split(r'\n(?=#)', text.replace('\r\n', '\n')) if part.strip()]
+        complete = parts if final else parts[:-1]
+        for index in range(self.reported, len(complete)):
+            self.on_section(index, complete[index].strip() + '\n')
+        self.reported = max(self.reported, len(complete))
+
+    def finish(self, text):
+        self.update(text, final=True)
+
+async def generate_job_posting(role, company, location=None, experience=None, requirements=None, conversation_history=None, deadline=None, mode=None, prepared_sections=None, on_section=None):
+    """Generate a job posting using AI with enhanced context.
+
+    With a deadline, falls back to the cached company description and the
+    built-in template when there is not enough time left for the LLM.
+    mode overrides POSTING_GENERATION_MODE. prepared_sections maps section
+    names to bodies drafted ahead of time, which are used as-is.
+    on_section(index, markdown) is called as each part of the posting is
+    ready: as the single prompt's response streams in, or as fan-out
+    sections finish.
+    """
+    print(f"Generating job posting for {role} at {company}")
+    
+    location_str = format_location(location)
+    experience, requirements = unwrap_extracted(experience), unwrap_extracted(requirements)
+
+    cached_posting = cached_warmup_posting(posting_cache_key(role, company, location_str, experience, requirements))
+    if cached_posting:
+        print(f"Using warmed-up posting for {role} at {company}")
+        return cached_posting
+
+    # Prepared drafts can only be reused section by section
+    if prepared_sections or (mode or POSTING_GENERATION_MODE) == 'fanout':
+        return await generate_job_posting_fanout_async(role, company, location_str, experience, requirements, conversation_history, deadline, prepared_sections, on_section)
 
     # Parallel fetch company description
-    company_description = await get_company_description_async(company)
+    company_description = await get_company_description_async(company, deadline)
+
+    if deadline is not None and not deadline.can_afford('generate'):
+        print(f"Deadline nearly spent ({deadline.remaining():.1f}s left), using template posting")
+        note_fallback('template posting')
+        return build_template_posting(role, company, location_str, experience, requirements, company_description)
     
     # Create context from conversation history
-    conversation_context = ""
-    if conversation_history:
-        conversation_context = "Previous conversation context:\n" + "\n".join([
-            f"User: {msg['user']}\nBot: {msg['bot']}" 
-            for msg in conversation_history[-3:]  # Use last 3 messages for context
-        ])
+    conversation_context = build_conversation_context(conversation_history)
 
     # Enhanced prompt with all available information
     prompt = f"""Create a detailed job posting using ALL the following information:
@@ -422,16 +1045,34 @@ Use this EXACT format and include ALL provided information:
 Replace the above bullet points with specific details relevant to a {role} position at {company}."""
 
     try:
-        response = await asyncio.to_thread(model.generate_content, prompt)
-        generated_text = response.text.strip()
+        streamed = StreamedPosting(on_section) if on_section else None
+        generated_text = await generate_text_async('generate', prompt, deadline, streamed and streamed.update)
+        if streamed:
+            streamed.finish(generated_text)
+        generated_text = generated_text.strip()
         
         # Verify all sections are present
-        required_sections = ['About', 'Role Overview', 'Key Responsibilities', 'Required Qualifications', 'Preferred Qualifications', 'Benefits']
-        missing_sections = [section for section in required_sections if section not in generated_text]
-        
-        if missing_sections or not generated_text.startswith('# '):
-            # If sections are missing, use the template with company description
-            generated_text = f"""# {role} at {company}{' - ' + location_str if location_str else ''}
+        if not generated_text.startswith('# '):
+            # Not a posting at all, use the template with company description
+            note_fallback('template posting')
+            generated_text = build_template_posting(role, company, location_str, experience, requirements, company_description)
+        elif find_missing_sections(generated_text):
+            # Only fill in what is missing instead of discarding the whole posting
+            generated_text = await repair_job_posting_async(generated_text, role, company, location_str, experience, requirements, deadline)
+
+        return generated_text
+    except asyncio.TimeoutError:
+        print("Job posting generation timed out, using template posting")
+        note_fallback('template posting')
+        return build_template_posting(role, company, location_str, experience, requirements, company_description)
+    except Exception as e:
+        print(f"Error generating job posting: {str(e)}")
+        note_fallback('no posting')
+        return None
+
+def build_template_posting(role, company, location_str, experience, requirements, company_description):
+    """Build a complete posting from the built-in template without calling the LLM"""
+    return f"""# {role} at {company}{' - ' + location_str if location_str else ''}
 
 ## About {company}
 {company_description}
@@ -468,17 +1109,400 @@ We are seeking an experienced {role} to join our team{' in ' + location_str if l
 * {'Flexible work arrangements' if not location_str else f'Modern office in {location_str}'}
 * {'Remote work options' if not location_str else 'Collaborative work environment'}
 """
-            
-        return generated_text
+
+def split_posting_sections(posting):
+    """Split a markdown posting into its title line and ordered (heading, body) pairs"""
+    title = None
+    sections = []
+    for line in posting.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        stripped = line.strip()
+        if stripped.startswith('## '):
+            sections.append((stripped[3:].strip(), []))
+        elif stripped.startswith('# ') and title is None and not sections:
+            title = stripped
+        elif sections:
+            sections[-1][1].append(line.rstrip())
+    return title, [(heading, '\n'.join(body).strip()) for heading, body in sections]
+
+def canonical_section(heading):
+    """Map a section heading to its POSTING_SECTIONS name, or None for custom sections"""
+    for name in POSTING_SECTIONS:
+        if name.lower() in heading.lower():
+            return name
+    return None
+
+def section_heading(section, company):
+    """Heading used when a canonical section is (re)generated"""
+    if section == 'About':
+        return f"About {company}"
+    if section == 'Benefits':
+        return "Benefits & Perks"
+    return section
+
+def find_missing_sections(posting):
+    """Return canonical sections that are absent or malformed, in canonical order"""
+    _, sections = split_posting_sections(posting)
+    present = {}
+    for heading, body in sections:
+        name = canonical_section(heading)
+        if name and name not in present:
+            present[name] = body
+
+    missing = []
+    for name in POSTING_SECTIONS:
+        body = present.get(name)
+        if not body:
+            missing.append(name)
+        elif name in LIST_SECTIONS and not any(line.strip().startswith(('*', '-')) for line in body.split('\n')):
+            missing.append(name)
+    return missing
+
+def assemble_posting(title, sections):
+    """Join a title and (heading, body) pairs back into a markdown posting"""
+    parts = [title] if title else []
+    parts.extend(f"## {heading}\n{body}" for heading, body in sections)
+    return '\n\n'.join(parts) + '\n'
+
+async def generate_section_async(section, role, company, location_str, experience, requirements, deadline=None, stage='repair', context=""):
+    """Generate the body of a single posting section.
+
+    Falls back to the matching section of the built-in template if the LLM
+    call fails or the deadline does not allow it.
+    """
+    if section == 'About':
+        return await get_company_description_async(company, deadline)
+
+    fallback_posting = build_template_posting(role, company, location_str, experience, requirements, "")
+    fallback = dict(
+        (canonical_section(heading), body) for heading, body in split_posting_sections(fallback_posting)[1]
+    ).get(section, "")
+
+    if deadline is not None and not deadline.can_afford(stage):
+        note_fallback(f"template {section} section")
+        return fallback
+
+    style = "Use '* ' bullet points." if section in LIST_SECTIONS else "Write plain paragraphs, no bullet points."
+    prompt = f"""Write the "{section_heading(section, company)}" section of a job posting.
+
+Role: {role}
+Company: {company}
+Location: {location_str if location_str else 'Location Flexible'}
+Experience Required: {experience if experience else 'Not specified'}
+Additional Requirements: {', '.join(requirements) if requirements else 'Not specified'}
+
+{context}
+
+Content: {SECTION_GUIDELINES[section]}
+{style}
+Return only the section body, without the heading."""
+
+    try:
+        response = await with_deadline(call_llm_async(stage, model.generate_content, prompt), deadline, stage)
+        body = response.text.strip()
+        # Drop a heading if the model added one anyway
+        if body.startswith('#'):
+            body = body.split('\n', 1)[1].strip() if '\n' in body else ''
+        if not body:
+            note_fallback(f"template {section} section")
+        return body or fallback
     except Exception as e:
-        print(f"Error generating job posting: {str(e)}")
-        return None
+        print(f"Error generating {section} section: {str(e) or type(e).__name__}")
+        note_fallback(f"template {section} section")
+        return fallback
+
+async def generate_job_posting_fanout_async(role, company, location_str, experience, requirements, conversation_history=None, deadline=None, prepared_sections=None, on_section=None):
+    """Generate every section with its own prompt, concurrently, and assemble them in order.
+
+    Wall-clock time tracks the slowest section rather than the whole document.
+    Sections in prepared_sections are not generated again. on_section(index,
+    markdown) receives the title (index 0) straight away and each section as
+    soon as it finishes, with index giving its place in the posting.
+    """
+    context = build_conversation_context(conversation_history)
+    prepared_sections = prepared_sections or {}
+
+    async def section_body(index, section):
+        body = prepared_sections.get(section)
+        if not body:
+            body = await generate_section_async(section, role, company, location_str, experience, requirements, deadline, 'generate', context)
+        return index, body
+
+    title = f"# {role} at {company}{' - ' + location_str if location_str else ''}"
+    if on_section:
+        on_section(0, assemble_posting(title, []))
+
+    sections = [None] * len(POSTING_SECTIONS)
+    for finished in asyncio.as_completed([section_body(index, section) for index, section in enumerate(POSTING_SECTIONS)]):
+        index, body = await finished
+        sections[index] = (section_heading(POSTING_SECTIONS[index], company), body)
+        if on_section:
+            on_section(index + 1, assemble_posting(None, [sections[index]]))
+    return assemble_posting(title, sections)
+
+def start_speculative_prefetch(role, company, experience=None, requirements=None):
+    """Use the user's think time to prepare what the final posting will most likely need.
+
+    Warms the company description cache and, once role and company are known,
+    drafts the role-specific sections in the background. Drafts are claimed
+    with take_prefetched_sections.
+    """
+    cancel_prefetch()
+    if not SPECULATIVE_PREFETCH or not (role or company):
+        return
+
+    experience, requirements = unwrap_extracted(experience), unwrap_extracted(requirements)
+    futures = {}
+    if company:
+        prefetch_executor.submit(run_async(get_company_description_async), company)
+    # Drafts name the company, so they are not written against a placeholder
+    if role and company:
+        for section in PREFETCH_SECTIONS:
+            futures[section] = prefetch_executor.submit(
+                run_async(generate_section_async), section, role, company, "", experience, requirements, None, 'prefetch'
+            )
+
+    print(f"Prefetching for {role} at {company}: {list(futures)}")
+    with prefetch_lock:
+        prefetch_state.update({
+            'inputs': prefetch_inputs(role, company, experience, requirements),
+            'started': time.monotonic(),
+            'futures': futures,
+        })
+
+def cancel_prefetch():
+    """Drop any pending prefetch; drafts still running are discarded when they finish"""
+    with prefetch_lock:
+        for future in prefetch_state.get('futures', {}).values():
+            future.cancel()
+        prefetch_state.clear()
+
+def prefetch_inputs(role, company, experience, requirements):
+    """Normalized inputs of a section draft, for checking it still matches the request"""
+    def normalize(value):
+        return str(value or '').strip().lower()
+
+    return (
+        normalize(role),
+        normalize(company),
+        normalize(unwrap_extracted(experience)),
+        tuple(sorted(normalize(item) for item in unwrap_extracted(requirements) or [])),
+    )
+
+def take_prefetched_sections(role, company, experience=None, requirements=None):
+    """Claim finished drafts if they were prepared with exactly these inputs.
+
+    Drafts are dropped when they have expired or the role, company,
+    experience or requirements have changed since they were started;
+    unfinished drafts are never waited for.
+    """
+    with prefetch_lock:
+        state = dict(prefetch_state)
+        prefetch_state.clear()
+    if not state:
+        return {}
+
+    expired = time.monotonic() - state['started'] > PREFETCH_TTL_SECONDS
+    changed = state['inputs'] != prefetch_inputs(role, company, experience, requirements)
+    sections = {}
+    for section, future in state['futures'].items():
+        if expired or changed or not future.done() or future.cancelled() or future.exception():
+            future.cancel()
+            continue
+        sections[section] = future.result()
+
+    print(f"Using prefetched sections: {list(sections)}" + (" (dropped: expired or changed)" if expired or changed else ""))
+    return sections
+
+async def repair_job_posting_async(posting, role, company, location=None, experience=None, requirements=None, deadline=None):
+    """Regenerate only the missing or malformed sections and splice them in.
+
+    Missing sections are generated concurrently. Malformed sections are
+    replaced in place and absent ones are inserted at their canonical position;
+    every other section is kept exactly as it was.
+    """
+    location_str = format_location(location)
+    experience, requirements = unwrap_extracted(experience), unwrap_extracted(requirements)
+
+    missing = find_missing_sections(posting)
+    if not missing:
+        return posting
+    print(f"Repairing job posting sections: {missing}")
+
+    bodies = await asyncio.gather(*[
+        generate_section_async(section, role, company, location_str, experience, requirements, deadline)
+        for section in missing
+    ])
+    repaired = dict(zip(missing, bodies))
+
+    title, sections = split_posting_sections(posting)
+    if not title:
+        title = f"# {role} at {company}{' - ' + location_str if location_str else ''}"
+
+    result = []
+    for heading, body in sections:
+        name = canonical_section(heading)
+        if name in repaired:
+            # Malformed section: replace in place, keeping its heading
+            body = repaired.pop(name)
+        result.append((heading, body))
+
+    # Insert absent sections before the first section that comes after them canonically
+    for name in POSTING_SECTIONS:
+        if name not in repaired:
+            continue
+        index = len(result)
+        for i, (heading, _) in enumerate(result):
+            existing = canonical_section(heading)
+            if existing and POSTING_SECTIONS.index(existing) > POSTING_SECTIONS.index(name):
+                index = i
+                break
+        result.insert(index, (section_heading(name, company), repaired[name]))
+
+    return assemble_posting(title, result)
+
+async def generate_job_posting_one_shot_async(message, deadline=None, on_section=None):
+    """Extract job details and generate the full posting with a single LLM call.
+
+    Returns (job_info, job_posting). job_info is None if the response could not
+    be parsed, and job_posting is None if the request was incomplete or the
+    generated posting failed validation, so callers can fall back to the
+    multi-step path for whatever is missing. With on_section, the response is
+    streamed and the posting's sections are reported as they are written.
+    """
+    print(f"Starting one-shot generation for message: {message}")
+
+    if deadline is not None and not deadline.can_afford('one_shot'):
+        return None, None
+
+    message = message.replace('\r\n', '\n').replace('\r', '\n').replace('\\n', '\n')
+
+    prompt = f"""
+    You are a job posting assistant. Read this message: "{message}"
+
+    Step 1 - Extract job information:
+    - role: normalize common terms (e.g., "dev" → "Developer", "BE" → "Backend")
+    - company: clean up company names (e.g., "fb" → "Facebook", "goog" → "Google")
+    - experience: years of experience mentioned (e.g., "15+ years", "minimum 5 years")
+    - location: city, state or country, or remote/hybrid/onsite; null if not mentioned
+    - requirements: technical skills, soft skills and specific requirements mentioned
+
+    Step 2 - Only if role, company AND location are all present with confidence >= 0.6,
+    write the complete job posting in markdown using EXACTLY this structure:
+
+    # <role> at <company> - <location>
+
+    ## About <company>
+    <2-3 sentences on the company's main business, industry and notable achievements>
+
+    ## Role Overview
+    <3-4 sentences on what the role involves, its impact and team structure, including location and experience>
+
+    ## Key Responsibilities
+    * <5-6 bullet points specific to the role>
+
+    ## Required Qualifications
+    * <bullet points, including the experience and every extracted requirement>
+
+    ## Preferred Qualifications
+    * <3-4 bullet points>
+
+    ## Benefits & Perks
+    * <4-5 bullet points>
+
+    Otherwise set "posting" to null.
+
+    Return JSON:
+    {{
+        "role": {{"value": "extracted role", "confidence": 0.0-1.0}},
+        "company": {{"value": "extracted company", "confidence": 0.0-1.0}},
+        "experience": {{"value": "extracted experience", "confidence": 0.0-1.0}},
+        "location": {{"value": "extracted location", "confidence": 0.0-1.0}},
+        "requirements": {{"value": ["requirement1", "requirement2"], "confidence": 0.0-1.0}},
+        "posting": "complete markdown job posting or null"
+    }}
+    """
+
+    # Always streamed, so the job details that arrive before a timeout are not lost
+    streamed = StreamedPosting(on_section) if on_section else None
+    parser = TolerantJSONParser()
+    received = ['']
+
+    def on_text(text):
+        parser.feed(text[len(received[0]):])
+        received[0] = text
+        if streamed:
+            # The posting is a JSON string value; read it from the partial object as it grows
+            value, _ = parser.result()
+            if isinstance(value, dict) and isinstance(value.get('posting'), str):
+                streamed.update(value['posting'])
+
+    try:
+        text = await generate_text_async('one_shot', prompt, deadline, on_text)
+        # Validated below rather than with a schema, since partial results must fall back
+        result = parse_llm_json(text, name='one-shot posting')
+        if streamed and isinstance(result, dict) and isinstance(result.get('posting'), str):
+            streamed.finish(result['posting'])
+    except Exception as e:
+        print(f"One-shot generation failed, falling back: {str(e) or type(e).__name__}")
+        # The extracted fields come before the posting, so once it has started they are complete
+        partial, _ = TolerantJSONParser().feed(received[0]).result()
+        if isinstance(partial, dict) and 'posting' in partial:
+            job_info, _ = validate_one_shot_result({**partial, 'posting': None})
+            return job_info, None
+        return None, None
+
+    return validate_one_shot_result(result)
+
+def validate_one_shot_result(result):
+    """Check a one-shot response locally and split it into (job_info, job_posting)"""
+    if not isinstance(result, dict) or not all(isinstance(result.get(field), dict) for field in EXTRACTION_SCHEMA):
+        return None, None
+
+    job_info = apply_schema(result, EXTRACTION_SCHEMA)
+    for field, spec in EXTRACTION_SCHEMA.items():
+        # The confidence says nothing about a value that was missing or mistyped
+        types, _ = spec['value']
+        if not isinstance(result[field].get('value'), types):
+            job_info[field]['confidence'] = 0.0
+
+    posting = result.get('posting')
+    if not isinstance(posting, str):
+        return job_info, None
+
+    posting = posting.strip()
+    complete = all(
+        job_info[field]['value'] and job_info[field]['confidence'] >= 0.6
+        for field in ['role', 'company', 'location']
+    )
+    missing_sections = [section for section in POSTING_SECTIONS if section not in posting]
+
+    if not complete or missing_sections or not posting.startswith('# '):
+        print(f"One-shot posting rejected, missing sections: {missing_sections}")
+        return job_info, None
+
+    return job_info, posting
 
 def format_job_posting(content):
     """Format the job posting with proper HTML and styling."""
     if not content:
         return "<div class='error'>Failed to generate job posting</div>"
+    return render_posting(content, 'html')
+
+def render_posting_html(content):
+    """Render a markdown posting as the HTML shown in the chat"""
+    formatted_content = '\n'.join(render_posting(content, 'sections'))
     
+    # Return container without buttons
+    return f'''<div class="job-posting-container">
+        <div class="job-posting">
+            <div class="job-content">
+                {formatted_content}
+            </div>
+        </div>
+    </div>'''
+
+def format_posting_sections(content):
+    """Format a markdown posting as HTML, one fragment per title or section"""
     print("Original content received for formatting:", content)
         
     # First, normalize line endings and ensure content is clean
@@ -552,19 +1576,93 @@ def format_job_posting(content):
             
             processed_sections.append('\n'.join(processed_lines))
     
-    # Join all processed sections
-    formatted_content = '\n'.join(processed_sections)
-    
-    print("Final formatted content:", formatted_content)
-    
-    # Return container without buttons
-    return f'''<div class="job-posting-container">
-        <div class="job-posting">
-            <div class="job-content">
-                {formatted_content}
-            </div>
-        </div>
-    </div>'''
+    print("Final formatted content:", '\n'.join(processed_sections))
+    return processed_sections
+
+def render_posting_markdown(content):
+    """Render a posting as normalized markdown"""
+    title, sections = split_posting_sections(content)
+    return assemble_posting(title, sections)
+
+def render_posting_text(content):
+    """Render a posting as plain text for job boards without markup support"""
+    title, sections = split_posting_sections(content)
+    lines = []
+    if title:
+        heading = title.lstrip('#').strip()
+        lines += [heading, '=' * len(heading), '']
+    for heading, body in sections:
+        lines += [heading, '-' * len(heading)]
+        for line in body.split('\n'):
+            line = re.sub(r'\*\*(.*?)\*\*', r'\1', line.strip())
+            if line.startswith(('* ', '- ')):
+                line = '- ' + line[2:].strip()
+            lines.append(line)
+        lines.append('')
+    return '\n'.join(lines).strip() + '\n'
+
+def render_posting_jsonld(content):
+    """Render a posting as schema.org JobPosting JSON-LD, without datePosted (see date_jsonld)"""
+    title, sections = split_posting_sections(content)
+    heading = (title or '').lstrip('#').strip()
+    match = re.match(r'(.+?)\s+at\s+(.+?)(?:\s+-\s+(.+))?$', heading)
+    role, company, location = match.groups() if match else (heading, None, None)
+
+    def bullets(section):
+        body = next((body for h, body in sections if canonical_section(h) == section), '')
+        return [line.strip().lstrip('*-').strip() for line in body.split('\n') if line.strip().startswith(('*', '-'))]
+
+    posting = {
+        "@context": "https://schema.org",
+        "@type": "JobPosting",
+        "title": role,
+        "description": render_posting(content, 'html'),
+        "responsibilities": bullets('Key Responsibilities'),
+        "qualifications": bullets('Required Qualifications'),
+        "jobBenefits": bullets('Benefits'),
+    }
+    if company:
+        posting["hiringOrganization"] = {"@type": "Organization", "name": company}
+    if location and 'remote' in location.lower():
+        posting["jobLocationType"] = "TELECOMMUTE"
+    elif location:
+        posting["jobLocation"] = {
+            "@type": "Place",
+            "address": {"@type": "PostalAddress", "addressLocality": location},
+        }
+    return json.dumps(posting, indent=2)
+
+def date_jsonld(jsonld, day):
+    """Add datePosted to a rendered JSON-LD posting; kept out of the cached render so it stays current"""
+    return json.dumps({**json.loads(jsonld), "datePosted": day.isoformat()}, indent=2)
+
+# Export formats: name -> (mimetype, file extension, renderer)
+EXPORT_FORMATS = {
+    'html': ('text/html', 'html', render_posting_html),
+    'text': ('text/plain', 'txt', render_posting_text),
+    'markdown': ('text/markdown', 'md', render_posting_markdown),
+    'jsonld': ('application/ld+json', 'json', render_posting_jsonld),
+}
+
+# Everything render_posting can produce: the export formats plus the per-section HTML used for streaming
+POSTING_RENDERERS = {fmt: renderer for fmt, (_, _, renderer) in EXPORT_FORMATS.items()}
+POSTING_RENDERERS['sections'] = format_posting_sections
+
+def render_posting(content, fmt):
+    """Render a posting in an export format, reusing earlier renders of the same content"""
+    key = (content_etag(content), fmt)
+    with render_cache_lock:
+        if key in render_cache:
+            render_cache.move_to_end(key)
+            return render_cache[key]
+
+    # Rendered outside the lock: renderers can call render_posting themselves
+    rendered = POSTING_RENDERERS[fmt](content)
+    with render_cache_lock:
+        render_cache[key] = rendered
+        if len(render_cache) > RENDER_CACHE_SIZE:
+            render_cache.popitem(last=False)
+    return rendered
 
 def generate_follow_up_question(extracted_info):
     """Generate conversational follow-up questions based on missing information."""
@@ -594,7 +1692,7 @@ def generate_follow_up_question(extracted_info):
     """
     
     try:
-        response = model.generate_content(prompt)
+        response = call_llm('chat', model.generate_content, prompt)
         return response.text.strip()
     except:
         # Fallback to basic responses
@@ -624,8 +1722,12 @@ def generate_follow_up_question(extracted_info):
         missing_str = " and ".join(missing_info)
         return f"Could you tell me more about the {missing_str} for this position?"
 
-def modify_job_posting(original_posting, modification_request):
-    """Modify the job posting based on user's request using Gemini."""
+def modify_job_posting(original_posting, modification_request, deadline=None):
+    """Modify the job posting based on user's request using Gemini.
+
+    With a deadline, the verification and retry calls are skipped once there
+    is not enough time left for them.
+    """
     prompt = f"""You are an expert at modifying job postings. Given a job posting and a modification request, generate an updated version.
 
 Current job posting:
@@ -652,8 +1754,10 @@ Rules:
 Return the complete modified job posting."""
     
     try:
-        response = model.generate_content(prompt)
+        response = call_llm('modify', model.generate_content, prompt, deadline=deadline)
         modified = response.text.strip()
+        if deadline is not None and not deadline.can_afford('modify'):
+            return modified
         
         # Verify the modification was applied
         verification_prompt = f"""Verify if the following modification was correctly applied:
@@ -672,10 +1776,11 @@ Return the complete modified job posting."""
             "error": "error message if failed, null if successful"
         }}"""
         
-        verify = model.generate_content(verification_prompt)
-        verify_json = json.loads(verify.text.strip())
+        verify = call_llm('modify', model.generate_content, verification_prompt, deadline=deadline)
+        verify_json = parse_llm_json(verify.text, VERIFICATION_SCHEMA, 'verification')
         
-        if verify_json['success']:
+        # An unreadable verdict is not a reason to throw the modification away
+        if verify_json is None or verify_json['success'] or (deadline is not None and not deadline.can_afford('modify')):
             return modified
         else:
             # Try one more time with a more specific prompt
@@ -689,14 +1794,203 @@ Return the complete modified job posting."""
             
             Focus on making ONLY the requested change while preserving everything else exactly as is."""
             
-            retry_response = model.generate_content(retry_prompt)
+            retry_response = call_llm('modify', model.generate_content, retry_prompt, deadline=deadline)
             return retry_response.text.strip()
             
     except Exception as e:
         print(f"Error modifying job posting: {str(e)}")
         return None
 
-def handle_posting_request(message):
+class EventLog:
+    """Durable append-only JSONL event log with batched writes.
+
+    append() only queues the event. A background writer collects events for
+    up to flush_interval seconds (or batch_size events) and commits the whole
+    group with a single write and fsync, keeping disk I/O off the request path.
+    """
+
+    def __init__(self, path, batch_size=EVENT_LOG_BATCH_SIZE, flush_interval=EVENT_LOG_FLUSH_MS / 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run, name='event-log', daemon=True)
+        self._writer.start()
+
+    def append(self, event):
+        self.queue.put({'ts': time.time(), **event})
+
+    def flush(self):
+        """Block until every queued event has been written"""
+        self.queue.join()
+
+    def read(self):
+        """Yield the events already on disk, skipping a torn final line"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            flush_at = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = flush_at - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(event) + '\n' for event in batch))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                print(f"Error writing event log: {str(e)}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+event_log = EventLog(EVENT_LOG_PATH)
+atexit.register(event_log.flush)
+
+def record_turn(user_input, result):
+    """Add a chat turn to the conversation history and the event log"""
+    turn = {'user': user_input, 'bot': result.get('response', '')}
+    conversation_history.append(turn)
+    del conversation_history[:-CONVERSATION_HISTORY_LIMIT]
+    chat_history.add_turn(turn['user'], turn['bot'])
+    event_log.append({'type': 'turn', **turn})
+
+def keyed_sections(sections):
+    """Key (heading, body) pairs by heading and occurrence ('Benefits#1'), so repeated headings stay distinct"""
+    seen = {}
+    keyed = []
+    for heading, body in sections:
+        seen[heading] = seen.get(heading, 0) + 1
+        keyed.append((f"{heading}#{seen[heading]}", body))
+    return keyed
+
+def section_key(key):
+    """Normalize a delta section key; keys logged without an occurrence refer to the first one"""
+    return key if re.search(r'#\d+$', key) else f"{key}#1"
+
+def posting_delta(old_posting, new_posting):
+    """Section-level difference between two postings: changed title, set/removed sections, new order"""
+    old_title, old_sections = split_posting_sections(old_posting) if old_posting else (None, [])
+    new_title, new_sections = split_posting_sections(new_posting)
+    old_sections, new_sections = keyed_sections(old_sections), keyed_sections(new_sections)
+    old_bodies = dict(old_sections)
+    new_bodies = dict(new_sections)
+
+    delta = {}
+    if new_title != old_title:
+        delta['title'] = new_title
+    changed = {key: body for key, body in new_sections if old_bodies.get(key) != body}
+    if changed:
+        delta['set'] = changed
+    removed = [key for key in old_bodies if key not in new_bodies]
+    if removed:
+        delta['removed'] = removed
+    if [key for key, _ in old_sections if key in new_bodies] + \
+            [key for key, _ in new_sections if key not in old_bodies] != [key for key, _ in new_sections]:
+        delta['order'] = [key for key, _ in new_sections]
+    return delta
+
+def apply_posting_delta(posting, delta):
+    """Apply a posting_delta to a posting (None for an empty one)"""
+    title, sections = split_posting_sections(posting) if posting else (None, [])
+    sections = keyed_sections(sections)
+    bodies = dict(sections)
+    order = [key for key, _ in sections]
+
+    title = delta.get('title', title)
+    for key in map(section_key, delta.get('removed', [])):
+        if key in bodies:
+            del bodies[key]
+            order.remove(key)
+    for key, body in delta.get('set', {}).items():
+        key = section_key(key)
+        if key not in bodies:
+            order.append(key)
+        bodies[key] = body
+    order = [section_key(key) for key in delta.get('order', order)]
+    return assemble_posting(title, [(key.rsplit('#', 1)[0], bodies[key]) for key in order])
+
+def replay_revisions(revisions):
+    """Rebuild a posting from its chain of revisions"""
+    posting = None
+    for revision in revisions:
+        posting = apply_posting_delta(None if revision.get('base') else posting, revision['delta'])
+    return posting
+
+def set_final_posting(posting, reason):
+    """Store a new version of the posting, logging it as a delta from the previous one.
+
+    Newly generated postings start a new revision chain; modifications extend it.
+    """
+    base = reason == 'generated'
+    if base:
+        posting_revisions.clear()
+    delta = posting_delta(None if base else conversation_state.get('final_job_posting'), posting)
+    revision = {'rev': len(posting_revisions), 'reason': reason, 'base': base, 'delta': delta}
+    posting_revisions.append(revision)
+    conversation_state['final_job_posting'] = posting
+    event_log.append({'type': 'revision', **revision})
+
+def undo_last_revision():
+    """Restore the previous version of the posting; returns it, or None if there is nothing to undo"""
+    if len(posting_revisions) < 2:
+        return None
+    posting_revisions.pop()
+    posting = replay_revisions(posting_revisions)
+    conversation_state['final_job_posting'] = posting
+    event_log.append({'type': 'undo', 'rev': len(posting_revisions)})
+    return posting
+
+def load_event_log():
+    """Restore conversation history and the current posting from the event log"""
+    for event in event_log.read():
+        if event.get('type') == 'turn':
+            conversation_history.append({'user': event.get('user', ''), 'bot': event.get('bot', '')})
+        elif event.get('type') == 'revision':
+            if event.get('base'):
+                posting_revisions.clear()
+            posting_revisions.append({key: event[key] for key in ('rev', 'reason', 'base', 'delta') if key in event})
+        elif event.get('type') == 'undo' and posting_revisions:
+            posting_revisions.pop()
+    del conversation_history[:-CONVERSATION_HISTORY_LIMIT]
+    if posting_revisions:
+        conversation_state['final_job_posting'] = replay_revisions(posting_revisions)
+
+def undo_response():
+    """Undo the last change to the posting and build the chat response"""
+    posting = undo_last_revision()
+    if posting is None:
+        return {
+            "response": "There are no changes to undo.",
+            "isJobPosting": False
+        }
+    conversation_state['last_action'] = 'showing_posting'
+    formatted_posting = format_job_posting(posting)
+    return {
+        "response": "I've undone the last change. Here's the previous version:",
+        "job_posting": formatted_posting,
+        "postingEtag": content_etag(formatted_posting),
+        "isJobPosting": True,
+        "followUp": "Would you like to make any other changes, or should we proceed with posting?"
+    }
+
+def handle_posting_request(message, deadline=None):
     """Handle user's response to posting the job."""
     intent_prompt = f"""
     Analyse user intent. Analyze if the user wants to modify or post the job posting.
@@ -711,8 +2005,10 @@ def handle_posting_request(message):
     """
     
     try:
-        response = model.generate_content(intent_prompt)
-        result = json.loads(response.text.strip())
+        response = call_llm('intent', model.generate_content, intent_prompt, deadline=deadline)
+        result = parse_llm_json(response.text, INTENT_SCHEMA, 'intent')
+        if result is None:
+            raise ValueError("Could not parse intent response")
         
         if result['confidence'] < 0.6:
             return {
@@ -726,6 +2022,12 @@ def handle_posting_request(message):
                 "isJobPosting": False
             }
         else:  # intent is 'modify'
+            if deadline is not None and not deadline.can_afford('modify'):
+                return {
+                    "response": "That took longer than expected, so I have left the job posting unchanged.",
+                    "isJobPosting": False
+                }
+
             if conversation_state.get('final_job_posting'):
                 # Use Gemini to analyze the modification request and generate the modified posting
                 modification_prompt = f"""
@@ -750,8 +2052,8 @@ def handle_posting_request(message):
                 """
 
                 try:
-                    modification_response = model.generate_content(modification_prompt)
-                    modified_posting = modification_response.text.strip()
+                    # Sent with the recent conversation so follow-up requests like "also shorten that" resolve
+                    modified_posting = chat_history.send_message(modification_prompt, stage='modify', remember=False, deadline=deadline).strip()
                     
                     # Verify the modified posting has all required sections
                     required_sections = ['About', 'Role Overview', 'Key Responsibilities', 'Required Qualifications', 'Benefits']
@@ -764,12 +2066,13 @@ def handle_posting_request(message):
                         }
                     
                     # Update the stored posting and format it
-                    conversation_state['final_job_posting'] = modified_posting
+                    set_final_posting(modified_posting, 'modified')
                     formatted_posting = format_job_posting(modified_posting)
                     
                     return {
                         "response": "I've updated the job posting based on your request. Here's the modified version:",
                         "job_posting": formatted_posting,
+                        "postingEtag": content_etag(formatted_posting),
                         "isJobPosting": True,
                         "followUp": "Would you like to make any other changes, or should we proceed with posting?"
                     }
@@ -802,29 +2105,241 @@ def poll_job_posting():
             return jsonify({'ready': True, **result})
     return jsonify({'ready': False})
 
+def content_etag(content):
+    """Content hash used as the ETag of rendered pages and postings"""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()[:32]
+
+def choose_encoding(accept_encodings):
+    """Pick the supported compression the client rates highest, honouring q-values"""
+    return accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+@app.after_request
+def finalize_response(response):
+    """Add ETags, answer conditional GETs with 304 and compress large bodies"""
+    if response.is_streamed or response.direct_passthrough or response.status_code != 200:
+        return response
+
+    if request.method in ('GET', 'HEAD'):
+        etag, _ = response.get_etag()
+        if not etag:
+            # Weak, so the same tag stays valid for every Content-Encoding
+            response.set_etag(content_etag(response.get_data()), weak=True)
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if not encoding or 'Content-Encoding' in response.headers or response.content_length is None \
+            or response.content_length < COMPRESS_MIN_BYTES:
+        return response
+
+    etag, _ = response.get_etag()
+    cache_key = (etag, encoding)
+    body = compressed_cache.get(cache_key) if etag else None
+    if body is None:
+        body = compress_body(response.get_data(), encoding)
+        if etag:
+            with compressed_cache_lock:
+                if len(compressed_cache) >= COMPRESSED_CACHE_SIZE:
+                    compressed_cache.pop(next(iter(compressed_cache)))
+                compressed_cache[cache_key] = body
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.route('/llm_metrics')
+def llm_metrics_report():
+    """Per-stage Gemini call counts, queue wait and run times, and JSON parse outcomes"""
+    with llm_metrics_lock:
+        report = {}
+        for stage, stats in llm_metrics.items():
+            calls = stats['calls'] or 1
+            report[stage] = {
+                'calls': stats['calls'],
+                'failures': stats['failures'],
+                'limit': LLM_STAGE_LIMITS.get(stage, LLM_MAX_WORKERS),
+                'avg_queue_wait_ms': round(stats['queue_wait_total'] / calls * 1000, 1),
+                'max_queue_wait_ms': round(stats['queue_wait_max'] * 1000, 1),
+                'avg_run_time_ms': round(stats['run_time_total'] / calls * 1000, 1),
+            }
+        json_parses = dict(json_parse_stats)
+    return jsonify({'max_workers': LLM_MAX_WORKERS, 'stages': report, 'json_parses': json_parses})
+
 @app.route('/')
 def home():
     """Render the home page"""
-    return render_template('index.html')
+    # Re-render only when the template changes on disk
+    template_path = os.path.join(app.root_path, app.template_folder, 'index.html')
+    mtime = os.path.getmtime(template_path)
+    cached = page_cache.get('index.html')
+    if not cached or cached[0] != mtime:
+        html = render_template('index.html')
+        cached = (mtime, html, content_etag(html))
+        page_cache['index.html'] = cached
+
+    response = app.make_response(cached[1])
+    response.set_etag(cached[2], weak=True)
+    return response
+
+@app.route('/posting')
+def current_posting():
+    """Serve the current job posting as HTML, cacheable by its content hash"""
+    job_posting = conversation_state.get('final_job_posting')
+    if not job_posting:
+        return jsonify({"error": "No job posting has been generated yet"}), 404
+
+    formatted_posting = format_job_posting(job_posting)
+    response = app.make_response(formatted_posting)
+    response.set_etag(content_etag(formatted_posting), weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/export/<fmt>')
+def export_posting(fmt):
+    """Export the current job posting as html, text, markdown or jsonld"""
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown export format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}"}), 404
+
+    job_posting = conversation_state.get('final_job_posting')
+    if not job_posting:
+        return jsonify({"error": "No job posting has been generated yet"}), 404
+
+    mimetype, extension, _ = EXPORT_FORMATS[fmt]
+    body, etag = render_posting(job_posting, fmt), f"{content_etag(job_posting)}-{fmt}"
+    if fmt == 'jsonld':
+        today = date.today()
+        body, etag = date_jsonld(body, today), f"{etag}-{today.isoformat()}"
+    response = app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    if request.args.get('download'):
+        response.headers['Content-Disposition'] = f'attachment; filename="job-posting.{extension}"'
+    return response
+
+@app.route('/undo', methods=['POST'])
+def undo():
+    """Revert the job posting to its previous revision"""
+    return jsonify(undo_response())
 
 @app.route('/chat', methods=['POST'])
 def chat():
     """Chat route with improved job posting handling"""
+    data = request.get_json(silent=True) or {}
+    user_input = str(data.get('message', '')).strip()
+
+    # Clients that accept NDJSON get the posting section by section
+    if 'application/x-ndjson' in request.headers.get('Accept', ''):
+        response = app.response_class(stream_with_context(stream_chat_events(user_input)), mimetype='application/x-ndjson')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'  # Keep reverse proxies from buffering the stream
+        return response
+
+    result = handle_chat_message(user_input)
+    if user_input:
+        record_turn(user_input, result)
+    return jsonify(result)
+
+def stream_chat_events(user_input):
+    """Yield a chat turn as newline-delimited JSON events.
+
+    A 'status' event is sent straight away. While a new posting is generated,
+    each 'section' event is sent as soon as that section is ready; 'index'
+    is its place in the posting and a later event for the same index replaces
+    it. Then come the 'response', any sections of the final posting that
+    differ from what was streamed, an optional 'followUp' and 'done'. The
+    response's 'total' is the final number of sections.
+    """
+    def event(payload):
+        return json.dumps(payload) + '\n'
+
+    events = queue.Queue()
+
+    def on_section(index, markdown):
+        events.put(('section', index, markdown))
+
+    def work():
+        # Runs apart from the response so the turn completes even if the client goes away
+        result = {"response": "I encountered an error. Please try again with your request.", "isJobPosting": False}
+        try:
+            result = handle_chat_message(user_input, on_section)
+            if user_input:
+                record_turn(user_input, result)
+        finally:
+            events.put(('result', result))
+
+    threading.Thread(target=work, name='chat-stream', daemon=True).start()
+    yield event({'type': 'status', 'status': 'working', 'message': 'Working on your request'})
+
+    total = len(POSTING_SECTIONS) + 1
+    streamed = {}
+    while True:
+        item = events.get()
+        if item[0] == 'result':
+            result = item[1]
+            break
+        _, index, markdown = item
+        streamed[index] = '\n'.join(render_posting(markdown, 'sections'))
+        yield event({'type': 'section', 'index': index, 'total': total, 'html': streamed[index]})
+
+    job_posting = conversation_state.get('final_job_posting')
+    sections = render_posting(job_posting, 'sections') if result.get('isJobPosting') and job_posting else []
+    yield event({
+        'type': 'response',
+        'response': result.get('response'),
+        'isJobPosting': bool(sections),
+        'postingEtag': result.get('postingEtag'),
+        'total': len(sections),
+    })
+
+    # The stored posting can differ from the streamed parts (cached, repaired or modified postings)
+    for index, html in enumerate(sections):
+        if streamed.get(index) != html:
+            yield event({'type': 'section', 'index': index, 'total': len(sections), 'html': html})
+
+    if result.get('followUp'):
+        yield event({'type': 'followUp', 'text': result['followUp']})
+    yield event({'type': 'done'})
+
+def handle_chat_message(user_input, on_section=None):
+    """Handle one chat message and return the response payload.
+
+    on_section(index, markdown) is passed to the one-shot call and
+    generate_job_posting to report the sections of a new posting as they
+    are written.
+    """
     try:
-        data = request.json
-        user_input = data.get('message', '').strip()
-        
         if not user_input:
-            return jsonify({"response": "Please enter a message."})
+            return {"response": "Please enter a message."}
+
+        deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+
+        # Undo applies to the current posting whatever was asked last
+        if posting_revisions and user_input.lower().rstrip('.!') in UNDO_COMMANDS:
+            return undo_response()
 
         # Check if we're in a post-job-posting state
         if conversation_state.get('last_action') == 'showing_posting':
-            result = handle_posting_request(user_input)
+            result = handle_posting_request(user_input, deadline)
             conversation_state['last_action'] = 'handling_response'
-            return jsonify(result)
+            return result
         
+        # A complete first message can be handled with a single LLM call
+        job_info, job_posting = None, None
+        if ONE_SHOT_GENERATION and not conversation_state.get('has_asked_for_info'):
+            job_info, job_posting = run_async(generate_job_posting_one_shot_async)(user_input, deadline, on_section)
+
         # Extract job information with improved confidence
-        job_info = run_async(extract_job_info_async)(user_input)
+        if job_info is None:
+            job_info = run_async(extract_job_info_async)(user_input, deadline)
         
         # Store any valid information we've extracted
         if not conversation_state.get('partial_info'):
@@ -839,6 +2354,13 @@ def chat():
             partial_info['company'] = job_info['company']['value']
         if job_info['location']['confidence'] >= 0.6:
             partial_info['location'] = job_info['location']['value']
+        # Experience and skills from earlier messages still apply when the user only fills in a gap
+        if unwrap_extracted(job_info['experience']):
+            partial_info['experience'] = unwrap_extracted(job_info['experience'])
+        for requirement in unwrap_extracted(job_info['requirements']) or []:
+            requirements_so_far = partial_info.setdefault('requirements', [])
+            if requirement not in requirements_so_far:
+                requirements_so_far.append(requirement)
         
         # Check what information is still missing
         missing_info_response = generate_missing_info_response(job_info)
@@ -846,44 +2368,48 @@ def chat():
         if missing_info_response and not conversation_state.get('has_asked_for_info'):
             # First time asking for missing info
             conversation_state['has_asked_for_info'] = True
-            return jsonify({
+            start_speculative_prefetch(partial_info.get('role'), partial_info.get('company'), partial_info.get('experience'), partial_info.get('requirements'))
+            return {
                 "response": missing_info_response,
                 "isJobPosting": False
-            })
+            }
         
         # Generate job posting with available information
         role = partial_info.get('role') or job_info['role']['value'] or "Software Engineer"
         company = partial_info.get('company') or job_info['company']['value'] or "the Company"
         location = partial_info.get('location') or job_info['location']['value'] or "Remote"
+        experience = partial_info.get('experience')
+        requirements = partial_info.get('requirements')
         
         # Clear the state
         conversation_state['has_asked_for_info'] = False
         conversation_state['partial_info'] = None
         
-        # Generate the job posting
-        job_posting = run_async(generate_job_posting)(role, company, location, job_info['experience'], job_info['requirements'], conversation_history)
+        # Generate the job posting unless the one-shot call already produced it
+        prepared_sections = take_prefetched_sections(role, company, experience, requirements)
+        if not job_posting:
+            job_posting = run_async(generate_job_posting)(role, company, location, experience, requirements, conversation_history, deadline, prepared_sections=prepared_sections, on_section=on_section)
         
         # Debug print to verify content
         print("Generated job posting content:", job_posting)
         
         if not job_posting:
-            return jsonify({
+            return {
                 "response": "I encountered an error generating the job posting. Please try again.",
                 "isJobPosting": False
-            })
+            }
         
         # Verify all sections are present and content is complete
-        required_sections = ['About', 'Role Overview', 'Key Responsibilities', 'Required Qualifications', 'Benefits']
-        missing_sections = [section for section in required_sections if section not in job_posting]
+        missing_sections = find_missing_sections(job_posting)
         
         if missing_sections:
             print(f"Missing sections detected: {missing_sections}")
-            # Regenerate if missing sections
-            job_posting = run_async(generate_job_posting)(role, company, location, job_info['experience'], job_info['requirements'], conversation_history)
-            print("Regenerated job posting content:", job_posting)
+            # Repair only the affected sections; out of time, they come from the template
+            job_posting = run_async(repair_job_posting_async)(job_posting, role, company, location, experience, requirements, deadline)
+            print("Repaired job posting content:", job_posting)
         
         # Store the complete job posting and update state
-        conversation_state['final_job_posting'] = job_posting
+        set_final_posting(job_posting, 'generated')
         conversation_state['last_action'] = 'showing_posting'
         
         # Format the job posting with proper HTML
@@ -892,19 +2418,20 @@ def chat():
         # Debug print to verify formatted content
         print("Formatted job posting HTML:", formatted_posting)
         
-        return jsonify({
+        return {
             "response": "I've created a job posting based on your input. Here it is:",
             "job_posting": formatted_posting,
+            "postingEtag": content_etag(formatted_posting),
             "isJobPosting": True,
             "followUp": "Would you like to modify any part of this job posting, or would you like to proceed with posting it?"
-        })
+        }
             
     except Exception as e:
         print(f"Error in chat route: {str(e)}")
-        return jsonify({
+        return {
             "response": "I encountered an error. Please try again with your request.",
             "isJobPosting": False
-        })
+        }
 
 def generate_missing_info_response(job_info):
     """Generate a friendly message asking only for missing information."""
@@ -927,21 +2454,141 @@ def generate_missing_info_response(job_info):
     else:
         return f"Could you please provide the {', '.join(missing[:-1])}, and {missing[-1]}? This will help me create a comprehensive job post."
 
-async def get_company_description_async(company_name):
+async def get_company_description_async(company_name, deadline=None):
     """Async version of get_company_description with optimized prompt"""
+    cache_key = (company_name or '').strip().lower()
+    if cache_key in company_description_cache:
+        return company_description_cache[cache_key]
+
+    fallback = f"{company_name} is a company operating in its respective industry."
+    if deadline is not None and not deadline.can_afford('company'):
+        note_fallback(f"placeholder description of {company_name}")
+        return fallback
+
     prompt = f"Describe {company_name} in 2-3 sentences focusing on main business, industry, and notable achievements."
     try:
-        response = await asyncio.to_thread(model.generate_content, prompt)
-        return response.text.strip()
+        response = await with_deadline(call_llm_async('company', model.generate_content, prompt), deadline, 'company')
+        description = response.text.strip()
+        company_description_cache[cache_key] = description
+        return description
     except Exception as e:
-        print(f"Error getting company description: {str(e)}")
-        return f"{company_name} is a company operating in its respective industry."
+        print(f"Error getting company description: {str(e) or type(e).__name__}")
+        note_fallback(f"placeholder description of {company_name}")
+        return fallback
+
+def wait_for_server(port, timeout=60):
+    """Wait until the local server accepts connections"""
+    give_up_at = time.monotonic() + timeout
+    while time.monotonic() < give_up_at:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+def run_warmup(config_path=WARMUP_FILE, port=None):
+    """Pre-populate the company description and posting caches from the warm-up file.
+
+    Every LLM call it makes runs in the 'warmup' stage, one at a time and
+    paced to WARMUP_CALLS_PER_MINUTE, so live requests keep both the upstream
+    quota and their own stage slots. Items that needed a template or
+    placeholder fallback count as failed and are not cached.
+    """
+    if not os.path.exists(config_path):
+        print(f"No warm-up file at {config_path}, skipping warm-up")
+        return
+
+    try:
+        with open(config_path, encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not read warm-up file {config_path}: {str(e)}")
+        warmup_status['state'] = 'failed'
+        return
+
+    if port and not wait_for_server(port):
+        print("Server did not come up, skipping warm-up")
+        return
+
+    companies = [c for c in config.get('companies', []) if isinstance(c, str)]
+    postings = [p for p in config.get('postings', []) if isinstance(p, dict) and p.get('role') and p.get('company')]
+    companies += [p['company'] for p in postings if p['company'] not in companies]
+    warmup_status.update({'state': 'running', 'total': len(companies) + len(postings), 'done': 0, 'failed': 0})
+
+    def step(label, work, store=None):
+        warmup_status['current'] = label
+        fallbacks = []
+        tokens = llm_stage_override.set('warmup'), llm_fallbacks.set(fallbacks)
+        try:
+            result = work()
+            if fallbacks:
+                raise RuntimeError(f"fell back to {', '.join(fallbacks)}")
+            if store:
+                store(result)
+        except Exception as e:
+            warmup_status['failed'] += 1
+            print(f"Warm-up failed for {label}: {str(e)}")
+        finally:
+            llm_stage_override.reset(tokens[0])
+            llm_fallbacks.reset(tokens[1])
+        warmup_status['done'] += 1
+        print(f"Warm-up {warmup_status['done']}/{warmup_status['total']}: {label}")
+
+    for company in companies:
+        if company.strip().lower() not in company_description_cache:
+            step(company, lambda: run_async(get_company_description_async)(company))
+        else:
+            warmup_status['done'] += 1
+
+    for item in postings:
+        location_str = format_location(item.get('location'))
+        key = posting_cache_key(item['role'], item['company'], location_str, item.get('experience'), item.get('requirements'))
+        if cached_warmup_posting(key):
+            warmup_status['done'] += 1
+            continue
+
+        def generate(item=item):
+            return run_async(generate_job_posting)(
+                item['role'], item['company'], item.get('location'), item.get('experience'), item.get('requirements')
+            )
+        step(f"{item['role']} at {item['company']}", generate,
+             lambda posting, key=key: posting_cache.update({key: (posting, time.monotonic() + POSTING_CACHE_TTL_SECONDS)}))
+
+    warmup_status.update({'state': 'done', 'current': None})
+
+def cached_warmup_posting(key):
+    """Posting cached by the warm-up for this key, or None if there is none or it has expired"""
+    posting, expires_at = posting_cache.get(key, (None, 0))
+    if expires_at <= time.monotonic():
+        posting_cache.pop(key, None)
+        return None
+    return posting
+
+def start_warmup(port=None):
+    """Start the warm-up in the background; with a port, it waits for the server to accept traffic first"""
+    threading.Thread(target=run_warmup, kwargs={'port': port}, name='warmup', daemon=True).start()
+
+@app.route('/warmup_status')
+def warmup_status_report():
+    """Progress of the startup cache warm-up"""
+    return jsonify({
+        **warmup_status,
+        'cached_companies': len(company_description_cache),
+        'cached_postings': sum(1 for key in list(posting_cache) if cached_warmup_posting(key)),
+    })
+
+load_event_log()
 
 def main():
     """Main entry point for the bot"""
+    port, debug = 5001, True
     try:
+        # The debug reloader runs main() in a parent process that never serves requests
+        if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_warmup(port)
         # Run the Flask app
-        app.run(host='0.0.0.0', port=5001, debug=True)
+        app.run(host='0.0.0.0', port=port, debug=debug)
     except KeyboardInterrupt:
         print("Bot shutting down...")
     except Exception as e:
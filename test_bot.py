@@ -0,0 +1,669 @@
+"""
+Tests for JD Bot. Gemini is replaced by a scripted fake model, so no API key or network is needed.
+"""
+
+import concurrent.futures
+import gzip
+import json
+import os
+import tempfile
+import time
+
+import pytest
+
+os.environ.setdefault('GOOGLE_API_KEY', 'test-key')
+os.environ['EVENT_LOG_PATH'] = os.path.join(tempfile.mkdtemp(), 'events.jsonl')
+
+import google.generativeai as genai
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeChatSession:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = history
+
+    def send_message(self, message, **kwargs):
+        return self.model.generate_content(message)
+
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel; replies come from FakeModel.reply(prompt)"""
+
+    reply = staticmethod(lambda prompt: "")
+    prompts = []
+    chat_histories = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        FakeModel.prompts.append(prompt)
+        text = FakeModel.reply(prompt)
+        if stream:
+            return [FakeResponse(text[i:i + 40]) for i in range(0, len(text), 40)]
+        return FakeResponse(text)
+
+    def start_chat(self, history=None):
+        FakeModel.chat_histories.append(history or [])
+        return FakeChatSession(self, history or [])
+
+
+genai.list_models = lambda: []
+genai.GenerativeModel = FakeModel
+
+import bot  # noqa: E402
+
+
+POSTING = """# Backend Engineer at Acme - Pune
+
+## About Acme
+Acme builds logistics software.
+
+## Role Overview
+Design and run the services behind our delivery platform.
+
+## Key Responsibilities
+* Build APIs
+* Run production services
+
+## Required Qualifications
+* 3+ years of Python
+
+## Preferred Qualifications
+* Kafka
+
+## Benefits & Perks
+* Health insurance
+"""
+
+JOB_INFO = {
+    'role': {'value': 'Backend Engineer', 'confidence': 0.9},
+    'company': {'value': 'Acme', 'confidence': 0.9},
+    'experience': {'value': None, 'confidence': 0.0},
+    'location': {'value': 'Pune', 'confidence': 0.9},
+    'requirements': {'value': [], 'confidence': 0.0},
+}
+
+
+def scripted_reply(prompt):
+    if 'You are a job posting assistant' in prompt:
+        return json.dumps({**JOB_INFO, 'posting': POSTING})
+    if 'Extract ALL job-related' in prompt:
+        return json.dumps(JOB_INFO)
+    if 'Analyse user intent' in prompt:
+        return '{"intent": "modify", "confidence": 0.9}'
+    if prompt.startswith('Describe '):
+        return 'Acme builds logistics software.'
+    if prompt.startswith('Write the "'):
+        return '* Generated point'
+    if 'modification request' in prompt:
+        return POSTING.replace('Build APIs', 'Build and document APIs')
+    return ""
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(FakeModel, 'reply', staticmethod(scripted_reply))
+    monkeypatch.setattr(bot, 'SPECULATIVE_PREFETCH', False)
+    FakeModel.prompts.clear()
+    FakeModel.chat_histories.clear()
+    bot.chat_history.reset()
+    bot.posting_cache.clear()
+    bot.company_description_cache.clear()
+    bot.compressed_cache.clear()
+    bot.posting_revisions.clear()
+    bot.conversation_history.clear()
+    bot.conversation_state.update({
+        'final_job_posting': None,
+        'last_action': None,
+        'has_asked_for_info': False,
+        'partial_info': None,
+    })
+    yield
+    bot.event_log.flush()
+
+
+def chat(client, message):
+    response = client.post('/chat', json={'message': message})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_undo_after_modification():
+    client = bot.app.test_client()
+
+    generated = chat(client, 'Backend Engineer at Acme in Pune')
+    assert generated['isJobPosting']
+    original = bot.conversation_state['final_job_posting']
+
+    modified = chat(client, 'Mention documentation in the first responsibility')
+    assert modified['isJobPosting']
+    assert 'Build and document APIs' in bot.conversation_state['final_job_posting']
+    assert bot.conversation_state['last_action'] == 'handling_response'
+
+    undone = chat(client, 'undo')
+    assert undone['response'].startswith("I've undone the last change")
+    assert bot.conversation_state['final_job_posting'].strip() == original.strip()
+    assert bot.conversation_state['last_action'] == 'showing_posting'
+    assert len(bot.posting_revisions) == 1
+
+    assert chat(client, 'undo')['response'] == "There are no changes to undo."
+
+
+def test_modification_is_sent_with_conversation_history():
+    client = bot.app.test_client()
+    chat(client, 'Backend Engineer at Acme in Pune')
+    chat(client, 'Mention documentation in the first responsibility')
+
+    [history] = FakeModel.chat_histories
+    assert history[0] == {'role': 'user', 'parts': ['Backend Engineer at Acme in Pune']}
+    # The modification prompt itself is not kept, only the turn recorded by /chat
+    assert bot.chat_history.turns[-1][0] == 'Mention documentation in the first responsibility'
+
+
+def stream_chat(client, message):
+    response = client.post('/chat', json={'message': message}, headers={'Accept': 'application/x-ndjson'})
+    return [json.loads(line) for line in response.data.decode().splitlines()]
+
+
+def check_streamed_posting(events):
+    """The posting's sections all arrive before the response and match the final render"""
+    assert events[0]['type'] == 'status'
+    types = [event['type'] for event in events]
+    reply = types.index('response')
+    streamed = [event for event in events[:reply] if event['type'] == 'section']
+    assert sorted(event['index'] for event in streamed) == list(range(len(bot.POSTING_SECTIONS) + 1))
+    assert events[reply]['total'] == len(bot.POSTING_SECTIONS) + 1
+    # Everything was streamed already, so the final posting adds nothing
+    assert types[reply + 1:] == ['followUp', 'done']
+
+    rendered = bot.render_posting(bot.conversation_state['final_job_posting'], 'sections')
+    assert [html for _, html in sorted((event['index'], event['html']) for event in streamed)] == rendered
+
+
+def test_stream_keeps_the_one_shot_call():
+    check_streamed_posting(stream_chat(bot.app.test_client(), 'Backend Engineer at Acme in Pune'))
+    assert len(FakeModel.prompts) == 1
+    assert 'You are a job posting assistant' in FakeModel.prompts[0]
+
+
+def one_shot_reply(monkeypatch, reply, posting=None):
+    monkeypatch.setattr(FakeModel, 'reply', staticmethod(lambda prompt: (
+        reply if 'You are a job posting assistant' in prompt
+        else posting if posting and 'Create a detailed job posting' in prompt
+        else scripted_reply(prompt))))
+
+
+def test_unparseable_one_shot_falls_back_to_extraction(monkeypatch):
+    one_shot_reply(monkeypatch, 'Sorry, I cannot help with that.', POSTING)
+    assert chat(bot.app.test_client(), 'Backend Engineer at Acme in Pune')['isJobPosting']
+    assert any('Extract ALL job-related' in prompt for prompt in FakeModel.prompts)
+    assert bot.conversation_state['final_job_posting'] == POSTING.strip()
+
+
+def test_incomplete_one_shot_request_asks_for_missing_details(monkeypatch):
+    one_shot_reply(monkeypatch, json.dumps({**JOB_INFO, 'location': {'value': None, 'confidence': 0.0}, 'posting': None}))
+    assert not chat(bot.app.test_client(), 'Backend Engineer at Acme')['isJobPosting']
+    assert not any('Extract ALL job-related' in prompt or 'Create a detailed job posting' in prompt
+                   for prompt in FakeModel.prompts)
+    assert bot.conversation_state['partial_info']['role'] == 'Backend Engineer'
+
+
+def test_one_shot_posting_missing_sections_is_regenerated(monkeypatch):
+    one_shot_reply(monkeypatch, json.dumps({**JOB_INFO, 'posting': POSTING.split('## Benefits')[0]}), POSTING)
+    assert chat(bot.app.test_client(), 'Backend Engineer at Acme in Pune')['isJobPosting']
+    assert not any('Extract ALL job-related' in prompt for prompt in FakeModel.prompts)
+    assert sum('Create a detailed job posting' in prompt for prompt in FakeModel.prompts) == 1
+    assert bot.conversation_state['final_job_posting'] == POSTING.strip()
+
+
+def test_one_shot_fields_are_type_checked():
+    job_info, posting = bot.validate_one_shot_result({
+        **JOB_INFO,
+        'role': {'value': ['Backend Engineer'], 'confidence': 0.9},
+        'requirements': {'value': 'Python', 'confidence': 0.9},
+        'posting': POSTING,
+    })
+    assert job_info['role'] == {'value': None, 'confidence': 0.0}
+    assert job_info['requirements'] == {'value': [], 'confidence': 0.0}
+    assert job_info['company'] == JOB_INFO['company']
+    assert posting is None
+
+
+def test_stream_single_prompt_generation(monkeypatch):
+    monkeypatch.setattr(bot, 'ONE_SHOT_GENERATION', False)
+    monkeypatch.setattr(FakeModel, 'reply', staticmethod(
+        lambda prompt: POSTING if 'Create a detailed job posting' in prompt else scripted_reply(prompt)))
+    check_streamed_posting(stream_chat(bot.app.test_client(), 'Backend Engineer at Acme in Pune'))
+    assert sum('Create a detailed job posting' in prompt for prompt in FakeModel.prompts) == 1
+    assert not any(prompt.startswith('Write the "') for prompt in FakeModel.prompts)
+
+
+def test_stream_fanout_generation(monkeypatch):
+    monkeypatch.setattr(bot, 'ONE_SHOT_GENERATION', False)
+    monkeypatch.setattr(bot, 'POSTING_GENERATION_MODE', 'fanout')
+    check_streamed_posting(stream_chat(bot.app.test_client(), 'Backend Engineer at Acme in Pune'))
+    assert sum(prompt.startswith('Write the "') for prompt in FakeModel.prompts) == len(bot.POSTING_SECTIONS) - 1
+
+
+def test_streamed_posting_reports_complete_parts_only():
+    reported = []
+    streamed = bot.StreamedPosting(lambda index, markdown: reported.append((index, markdown)))
+    streamed.update('# Title\n\n## About\nAcme')
+    assert reported == [(0, '# Title\n')]
+    streamed.update('# Title\n\n## About\nAcme builds things.\n\n## Role')
+    streamed.finish('# Title\n\n## About\nAcme builds things.\n\n## Role Overview\nBuild.')
+    assert reported == [(0, '# Title\n'), (1, '## About\nAcme builds things.\n'), (2, '## Role Overview\nBuild.\n')]
+
+
+def parse(text):
+    return bot.TolerantJSONParser().feed(text).result()
+
+
+def test_parser_reads_fenced_json():
+    assert parse('Sure!\n```json\n{"intent": "post", "confidence": 0.8}\n```\nDone.') == \
+        ({'intent': 'post', 'confidence': 0.8}, False)
+
+
+def test_parser_accepts_newlines_inside_strings():
+    value, repaired = parse('{"posting": "# Title\n\n## About\nText"}')
+    assert value == {'posting': '# Title\n\n## About\nText'}
+    assert not repaired
+
+
+def test_parser_drops_trailing_commas():
+    assert parse('{"requirements": ["Python", "Go",], }') == ({'requirements': ['Python', 'Go']}, True)
+
+
+def test_parser_closes_truncated_object():
+    value, repaired = parse('{"role": {"value": "Backend Engineer", "confidence": 0.9}, "posting": "# Backend')
+    assert repaired
+    assert value == {'role': {'value': 'Backend Engineer', 'confidence': 0.9}, 'posting': '# Backend'}
+
+
+def test_parser_backs_off_to_last_complete_value():
+    value, _ = parse('{"role": "Engineer", "confidence": 0.')
+    assert value == {'role': 'Engineer'}
+
+
+def test_parser_accepts_chunked_input():
+    parser = bot.TolerantJSONParser()
+    for chunk in ['{"intent": "mo', 'dify", "conf', 'idence": 0.7}', ' trailing text']:
+        parser.feed(chunk)
+    assert parser.result() == ({'intent': 'modify', 'confidence': 0.7}, False)
+
+
+def test_parser_rescans_after_a_brace_in_prose():
+    assert parse('Here is {role}: {"intent": "post", "confidence": 0.9}') == ({'intent': 'post', 'confidence': 0.9}, False)
+
+
+def test_parser_rescans_across_chunks():
+    parser = bot.TolerantJSONParser()
+    for chunk in ['Use {placeholders} and {', 'braces}. {"intent": ', '"modify", "confidence": 0.7}']:
+        parser.feed(chunk)
+    assert parser.result() == ({'intent': 'modify', 'confidence': 0.7}, False)
+
+
+def test_parse_llm_json_returns_none_without_object():
+    assert bot.parse_llm_json('I could not do that.') is None
+
+
+def test_apply_schema_fills_defaults_and_drops_mistyped_values():
+    data = {'role': {'value': 'Engineer', 'confidence': 'high'}, 'requirements': {'value': 'Python'}, 'extra': 1}
+    result = bot.apply_schema(data, bot.EXTRACTION_SCHEMA)
+    assert result['role'] == {'value': 'Engineer', 'confidence': 0.0}
+    assert result['company'] == {'value': None, 'confidence': 0.0}
+    assert result['requirements'] == {'value': [], 'confidence': 0.0}
+    assert 'extra' not in result
+
+
+def test_apply_schema_defaults_are_not_shared():
+    first = bot.apply_schema({}, bot.EXTRACTION_SCHEMA)
+    first['requirements']['value'].append('Python')
+    assert bot.apply_schema({}, bot.EXTRACTION_SCHEMA)['requirements']['value'] == []
+
+
+def test_additional_details_follow_the_job_details_schema(monkeypatch):
+    monkeypatch.setattr(FakeModel, 'reply', staticmethod(
+        lambda prompt: '{"skills": "Python", "tech_stack": ["Kafka"], "location": {"city": "Pune"}, "total_experience": 5}'))
+    details = bot.extract_additional_details('5 years of Python and Kafka in Pune')
+    assert details == {
+        'total_experience': 5,
+        'relevant_experience': None,
+        'skills': [],
+        'tech_stack': ['Kafka'],
+        'requirements': [],
+        'education': None,
+        'location': {'city': 'Pune', 'state': None, 'country': None},
+    }
+
+
+def prefetch(monkeypatch, role, company, experience=None, requirements=None):
+    monkeypatch.setattr(bot, 'SPECULATIVE_PREFETCH', True)
+    bot.start_speculative_prefetch(role, company, experience, requirements)
+    concurrent.futures.wait(bot.prefetch_state['futures'].values())
+
+
+def test_prefetched_sections_are_used_for_the_same_request(monkeypatch):
+    prefetch(monkeypatch, 'Backend Engineer', 'Acme', '5 years', ['Python', 'Go'])
+    sections = bot.take_prefetched_sections('backend engineer', 'Acme', '5 years', ['go', 'Python'])
+    assert set(sections) == set(bot.PREFETCH_SECTIONS)
+
+
+@pytest.mark.parametrize('experience, requirements', [
+    ('5 years', ['Python', 'Go', 'Kafka']),
+    ('8 years', ['Python', 'Go']),
+])
+def test_prefetched_sections_are_dropped_when_details_change(monkeypatch, experience, requirements):
+    prefetch(monkeypatch, 'Backend Engineer', 'Acme', '5 years', ['Python', 'Go'])
+    assert bot.take_prefetched_sections('Backend Engineer', 'Acme', experience, requirements) == {}
+
+
+def test_sections_are_not_drafted_without_a_company(monkeypatch):
+    prefetch(monkeypatch, 'Backend Engineer', None)
+    assert bot.take_prefetched_sections('Backend Engineer', 'the Company') == {}
+
+
+def test_follow_up_answer_keeps_earlier_details(monkeypatch):
+    monkeypatch.setattr(bot, 'SPECULATIVE_PREFETCH', True)
+    monkeypatch.setattr(bot, 'ONE_SHOT_GENERATION', False)
+    first = dict(JOB_INFO, location={'value': None, 'confidence': 0.0},
+                 experience={'value': '5 years', 'confidence': 0.9}, requirements={'value': ['Python'], 'confidence': 0.9})
+    answer = {key: {'value': None, 'confidence': 0.0} for key in JOB_INFO}
+    answer['location'] = {'value': 'Pune', 'confidence': 0.9}
+    replies = iter([first, answer])
+    monkeypatch.setattr(bot, 'extract_job_info_async', lambda message, deadline=None: async_value(next(replies)))
+    client = bot.app.test_client()
+
+    assert not chat(client, 'Backend Engineer at Acme, 5 years of Python')['isJobPosting']
+    concurrent.futures.wait(bot.prefetch_state['futures'].values())
+    FakeModel.prompts.clear()
+    assert chat(client, 'Pune')['isJobPosting']
+
+    # Only the sections that were not drafted are generated now, with the earlier details
+    section_prompts = [prompt for prompt in FakeModel.prompts if prompt.startswith('Write the "')]
+    assert len(section_prompts) == len(bot.POSTING_SECTIONS) - 1 - len(bot.PREFETCH_SECTIONS)
+    assert all('5 years' in prompt and 'Python' in prompt for prompt in section_prompts)
+
+
+async def async_value(value):
+    return value
+
+
+def test_modification_stops_at_the_deadline(monkeypatch):
+    monkeypatch.setattr(bot, 'MIN_STAGE_SECONDS', 0)
+    monkeypatch.setattr(FakeModel, 'reply', staticmethod(
+        lambda prompt: time.sleep(1) or '' if 'modification request' in prompt else scripted_reply(prompt)))
+    bot.conversation_state['final_job_posting'] = POSTING
+
+    start = time.monotonic()
+    result = bot.handle_posting_request('Shorten the overview', bot.Deadline(0.3))
+    assert time.monotonic() - start < 0.8
+    assert not result['isJobPosting']
+    assert bot.conversation_state['final_job_posting'] == POSTING
+
+
+def test_one_shot_timeout_keeps_the_streamed_job_details(monkeypatch):
+    monkeypatch.setattr(bot, 'MIN_STAGE_SECONDS', 0)
+    text = json.dumps({**JOB_INFO, 'posting': POSTING})
+    cut = text.index('"posting"') + 20
+
+    def stalled_stream(self, prompt, stream=False, **kwargs):
+        yield FakeResponse(text[:cut])
+        time.sleep(1)
+
+    monkeypatch.setattr(FakeModel, 'generate_content', stalled_stream)
+    job_info, posting = bot.run_async(bot.generate_job_posting_one_shot_async)(
+        'Backend Engineer at Acme in Pune', bot.Deadline(0.4))
+    assert posting is None
+    assert job_info['role']['value'] == 'Backend Engineer'
+    assert job_info['location']['value'] == 'Pune'
+
+
+def test_slow_upstream_does_not_lose_the_request(monkeypatch):
+    monkeypatch.setattr(bot, 'MIN_STAGE_SECONDS', 0.05)
+    monkeypatch.setattr(bot, 'REQUEST_DEADLINE_SECONDS', 1)
+    monkeypatch.setattr(FakeModel, 'reply', staticmethod(lambda prompt: time.sleep(1.5) or scripted_reply(prompt)))
+
+    result = chat(bot.app.test_client(), 'Senior Data Scientist at Globex Corp, Bangalore')
+    assert result['isJobPosting']
+    assert '# Senior Data Scientist at Globex Corp - Bangalore' in bot.conversation_state['final_job_posting']
+
+
+@pytest.mark.parametrize('message, expected', [
+    ("We're hiring a Backend Engineer at Acme in Pune.", ('Backend Engineer', 'Acme', 'Pune')),
+    ('Staff engineer at Stripe, San Francisco with 8+ years', ('Staff engineer', 'Stripe', 'San Francisco')),
+    ('Role: Product Manager\nCompany: Initech\nLocation: Austin', ('Product Manager', 'Initech', 'Austin')),
+    ('I need help writing a job posting', (None, None, None)),
+])
+def test_local_extraction(message, expected):
+    job_info = bot.extract_job_info_locally(message)
+    assert tuple(job_info[field]['value'] for field in ('role', 'company', 'location')) == expected
+
+
+def test_modification_skips_verification_without_time_left(monkeypatch):
+    monkeypatch.setattr(bot, 'MIN_STAGE_SECONDS', 5)
+    modified = bot.modify_job_posting(POSTING, 'Shorten the overview', bot.Deadline(5))
+    assert modified == POSTING.replace('Build APIs', 'Build and document APIs').strip()
+    assert len(FakeModel.prompts) == 1
+
+
+def test_warmup_paces_every_llm_call(monkeypatch, tmp_path):
+    config = tmp_path / 'warmup.json'
+    config.write_text(json.dumps({'companies': ['Acme'], 'postings': [{'role': 'Backend Engineer', 'company': 'Globex'}]}))
+    monkeypatch.setitem(bot.LLM_STAGE_INTERVALS, 'warmup', 0.1)
+    monkeypatch.setattr(bot, 'POSTING_GENERATION_MODE', 'single')
+    bot.company_description_cache.clear()
+    monkeypatch.setattr(bot, 'llm_metrics', {})
+    started = []
+    monkeypatch.setattr(FakeModel, 'reply', staticmethod(lambda prompt: started.append(time.monotonic()) or scripted_reply(prompt)))
+
+    bot.run_warmup(str(config))
+
+    # Acme's description, then Globex's description and posting
+    assert list(bot.llm_metrics) == ['warmup']
+    assert bot.llm_metrics['warmup']['calls'] == len(started) == 3
+    assert all(later - earlier >= 0.09 for earlier, later in zip(started, started[1:]))
+    assert bot.llm_stage_override.get() is None
+
+
+def test_jsonld_export_is_dated_on_each_request(monkeypatch):
+    bot.conversation_state['final_job_posting'] = POSTING
+    client = bot.app.test_client()
+
+    class Day(bot.date):
+        current = bot.date(2024, 1, 1)
+
+        @classmethod
+        def today(cls):
+            return cls.current
+
+    monkeypatch.setattr(bot, 'date', Day)
+    first = client.get('/export/jsonld')
+    Day.current = bot.date(2024, 1, 2)
+    second = client.get('/export/jsonld', headers={'If-None-Match': first.headers['ETag']})
+
+    assert first.get_json()['datePosted'] == '2024-01-01'
+    assert second.status_code == 200
+    assert second.get_json()['datePosted'] == '2024-01-02'
+    assert second.get_json()['hiringOrganization']['name'] == 'Acme'
+
+
+@pytest.mark.parametrize('path', ['/', '/posting'])
+def test_conditional_get_returns_not_modified(path):
+    bot.conversation_state['final_job_posting'] = POSTING
+    client = bot.app.test_client()
+
+    first = client.get(path)
+    assert first.status_code == 200
+    assert first.headers['ETag'].startswith('W/')
+    second = client.get(path, headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 304
+    assert not second.data
+
+
+def test_only_bodies_over_the_threshold_are_compressed(monkeypatch):
+    bot.conversation_state['final_job_posting'] = POSTING
+    client = bot.app.test_client()
+    size = len(client.get('/posting').data)
+
+    monkeypatch.setattr(bot, 'COMPRESS_MIN_BYTES', size + 1)
+    small = client.get('/posting', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+    assert 'Accept-Encoding' in small.headers['Vary']
+
+    monkeypatch.setattr(bot, 'COMPRESS_MIN_BYTES', size)
+    large = client.get('/posting', headers={'Accept-Encoding': 'gzip'})
+    assert large.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in large.headers['Vary']
+    assert gzip.decompress(large.data) == small.data
+
+
+def test_compressed_bodies_are_reused(monkeypatch):
+    compressions = []
+    compress_body = bot.compress_body
+    monkeypatch.setattr(bot, 'compress_body', lambda data, encoding: compressions.append(encoding) or compress_body(data, encoding))
+    client = bot.app.test_client()
+
+    first = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    second = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert second.data == first.data
+    assert compressions == ['gzip']
+
+
+@pytest.mark.parametrize('accept, expected', [
+    ('gzip;q=0, identity', None),
+    ('identity', None),
+    ('br;q=0, gzip', 'gzip'),
+    ('deflate, gzip', 'gzip'),
+])
+def test_compression_honours_accept_encoding_weights(accept, expected):
+    response = bot.app.test_client().get('/', headers={'Accept-Encoding': accept})
+    assert response.headers.get('Content-Encoding') == expected
+
+
+DUPLICATES = """# Backend Engineer at Acme
+
+## Notes
+First note
+
+## Notes
+Second note
+
+## Benefits & Perks
+* Health insurance
+"""
+
+
+@pytest.mark.parametrize('old, new', [
+    (None, POSTING),
+    (POSTING, POSTING.replace('* Kafka', '* Kafka\n* Go')),
+    (POSTING, POSTING.replace('# Backend Engineer', '# Senior Backend Engineer')),
+    (POSTING, POSTING.replace('## Preferred Qualifications\n* Kafka\n\n', '')),
+    (DUPLICATES, DUPLICATES.replace('Second note', 'Changed note')),
+    (DUPLICATES, DUPLICATES.replace('## Notes\nFirst note\n\n', '')),
+    (DUPLICATES, DUPLICATES + '\n## Notes\nThird note\n'),
+    (DUPLICATES, DUPLICATES.replace('## Notes\nFirst note', '## Benefits & Perks\n* Gym').replace(
+        '## Benefits & Perks\n* Health insurance', '## Notes\nFirst note')),
+], ids=['new', 'changed-list', 'changed-title', 'removed', 'changed-duplicate', 'removed-duplicate',
+        'added-duplicate', 'reordered-duplicates'])
+def test_posting_delta_round_trip(old, new):
+    delta = bot.posting_delta(old, new)
+    json.dumps(delta)  # Revisions are written to the event log
+    assert bot.apply_posting_delta(old, delta) == bot.render_posting_markdown(new)
+
+
+def test_posting_delta_only_records_changed_sections():
+    delta = bot.posting_delta(DUPLICATES, DUPLICATES.replace('Second note', 'Changed note'))
+    assert delta == {'set': {'Notes#2': 'Changed note'}}
+
+
+def test_delta_logged_with_plain_headings_still_applies():
+    delta = {'set': {'Preferred Qualifications': '* Go'}, 'removed': ['Benefits & Perks']}
+    _, sections = bot.split_posting_sections(bot.apply_posting_delta(POSTING, delta))
+    assert dict(sections)['Preferred Qualifications'] == '* Go'
+    assert 'Benefits & Perks' not in dict(sections)
+    assert len(sections) == 5
+
+
+def test_find_missing_sections_accepts_complete_posting():
+    assert bot.find_missing_sections(POSTING) == []
+
+
+def test_find_missing_sections_reports_absent_and_malformed_sections():
+    posting = POSTING.replace('## Role Overview\nDesign and run the services behind our delivery platform.\n\n', '') \
+        .replace('* Build APIs\n* Run production services', 'Build APIs and run production services.') \
+        .replace('* Health insurance', '')
+    assert bot.find_missing_sections(posting) == ['Role Overview', 'Key Responsibilities', 'Benefits']
+
+
+def test_repair_splices_only_the_missing_sections():
+    posting = POSTING.replace('## Role Overview\nDesign and run the services behind our delivery platform.\n\n', '') \
+        .replace('* Build APIs\n* Run production services', 'Build APIs and run production services.') \
+        .replace('## Benefits & Perks', '## Team\nSmall and friendly.\n\n## Benefits & Perks')
+
+    repaired = bot.run_async(bot.repair_job_posting_async)(posting, 'Backend Engineer', 'Acme', 'Pune')
+
+    title, sections = bot.split_posting_sections(repaired)
+    assert title == '# Backend Engineer at Acme - Pune'
+    assert [heading for heading, _ in sections] == [
+        'About Acme', 'Role Overview', 'Key Responsibilities', 'Required Qualifications',
+        'Preferred Qualifications', 'Team', 'Benefits & Perks',
+    ]
+    bodies = dict(sections)
+    assert bodies['Role Overview'] == bodies['Key Responsibilities'] == '* Generated point'
+    assert bodies['Team'] == 'Small and friendly.'
+    assert bodies['Required Qualifications'] == '* 3+ years of Python'
+    assert sorted(prompt.split('"')[1] for prompt in FakeModel.prompts) == ['Key Responsibilities', 'Role Overview']
+
+
+def write_warmup(tmp_path):
+    config = tmp_path / 'warmup.json'
+    config.write_text(json.dumps({'companies': ['Acme'], 'postings': [{'role': 'Backend Engineer', 'company': 'Globex'}]}))
+    return str(config)
+
+
+def test_warmup_counts_failed_calls_and_caches_nothing(monkeypatch, tmp_path):
+    monkeypatch.setitem(bot.LLM_STAGE_INTERVALS, 'warmup', 0)
+
+    def unavailable(prompt):
+        raise RuntimeError('503 Service Unavailable')
+    monkeypatch.setattr(FakeModel, 'reply', staticmethod(unavailable))
+
+    bot.run_warmup(write_warmup(tmp_path))
+
+    assert bot.warmup_status['done'] == bot.warmup_status['failed'] == 3
+    assert bot.company_description_cache == {} and bot.posting_cache == {}
+
+
+def test_warmup_does_not_cache_template_postings(monkeypatch, tmp_path):
+    monkeypatch.setitem(bot.LLM_STAGE_INTERVALS, 'warmup', 0)
+    monkeypatch.setattr(bot, 'POSTING_GENERATION_MODE', 'single')
+    # Descriptions work, but the posting prompt gets something that is not a posting
+    monkeypatch.setattr(FakeModel, 'reply', staticmethod(
+        lambda prompt: 'Sorry, I cannot help with that.' if 'Create a detailed job posting' in prompt else scripted_reply(prompt)))
+
+    bot.run_warmup(write_warmup(tmp_path))
+
+    assert bot.warmup_status['failed'] == 1
+    assert set(bot.company_description_cache) == {'acme', 'globex'}
+    assert bot.posting_cache == {}
+
+
+def test_warmed_up_postings_expire(monkeypatch, tmp_path):
+    monkeypatch.setitem(bot.LLM_STAGE_INTERVALS, 'warmup', 0)
+    monkeypatch.setattr(bot, 'POSTING_GENERATION_MODE', 'single')
+    monkeypatch.setattr(FakeModel, 'reply', staticmethod(
+        lambda prompt: POSTING if 'Create a detailed job posting' in prompt else scripted_reply(prompt)))
+    bot.run_warmup(write_warmup(tmp_path))
+    [key] = bot.posting_cache
+    assert bot.cached_warmup_posting(key) == POSTING.strip()
+
+    bot.posting_cache[key] = (POSTING, time.monotonic() - 1)
+    assert bot.cached_warmup_posting(key) is None
+    assert key not in bot.posting_cache